@@ -0,0 +1,160 @@
+"""
+Micro-benchmarks for the annotation core and divergence.
+
+    python benchmarks/bench_core.py --depth 5 --fanout 4 --output bench.json
+
+Run against an installed package (pip install -e .); results are printed and,
+with --output, written as JSON so that runs can be compared between releases.
+"""
+
+
+import argparse
+import json
+import os
+import platform
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import vulcan_annotation
+from vulcan_annotation import Annotation, utilities
+from synthetic import DEFAULT_MIX, generate_answers, generate_category, mutate_answer, parse_mix
+
+
+def measure(func, items, repeat, prepare=None):
+    # best and mean wall time of calling func on every item, over repeat runs;
+    # prepare(item) runs before each call and is not timed
+    runs = []
+    for _ in range(repeat):
+        elapsed = 0.0
+        for item in items:
+            if prepare is not None:
+                prepare(item)
+            start = time.perf_counter()
+            func(item)
+            elapsed += time.perf_counter() - start
+        runs.append(elapsed)
+    calls = max(len(items), 1)
+    return {
+        'calls': len(items),
+        'best_s': min(runs),
+        'mean_s': sum(runs) / len(runs),
+        'per_call_us': min(runs) / calls * 1e6,
+    }
+
+
+def selectors_for(category, rng, count):
+    # plain key, direct child and descendant selectors over existing keys
+    nodes = [n for n in category.get_all_nodes() if n.parent is not None]
+    selectors = []
+    for _ in range(count):
+        node = rng.choice(nodes)
+        if node.parent.parent is not None and rng.random() < 0.5:
+            selectors.append("%s > %s" % (node.parent.key, node.key))
+        elif node.parent.parent is not None:
+            selectors.append("%s %s" % (node.parent.key, node.key))
+        else:
+            selectors.append(node.key)
+    return selectors
+
+
+def run(args):
+    mix = parse_mix(args.mix) if args.mix else DEFAULT_MIX
+    category_dict = generate_category(args.depth, args.fanout, mix, seed=args.seed)
+    answers = generate_answers(category_dict, args.answers, args.select_rate, seed=args.seed)
+    rng = random.Random(args.seed)
+    va = Annotation(category_dict)
+    selectors = selectors_for(va, rng, args.answers)
+    pairs = [(a, mutate_answer(a, rng)) for a in answers]
+
+    results = {}
+    results['construction'] = measure(lambda _: Annotation(category_dict), range(args.builds), args.repeat)
+
+    results['decompile'] = measure(va.decompile, answers, args.repeat)
+    # decompiling first leaves the whole tree dirty, so compile is a full rebuild
+    results['compile'] = measure(lambda a: va.compile(), answers, args.repeat, prepare=va.decompile)
+    results['compile_shared'] = measure(lambda a: va.compile(shared=True), answers, args.repeat, prepare=va.decompile)
+    # the autosave pattern: one node toggled, then the answer compiled again;
+    # the default copy is linear in the answer, shared results and diff
+    # against the previous one only walk the changed path
+    va.decompile(answers[0])
+    toggled = [rng.choice(va.get_all_nodes()) for _ in range(args.answers)]
+    results['toggle_compile'] = measure(lambda n: (n.toggle(), va.compile()), toggled, args.repeat)
+    results['toggle_compile_shared'] = measure(lambda n: (n.toggle(), va.compile(shared=True)), toggled, args.repeat)
+    saved = [va.compile(shared=True)]
+    def autosave(node):
+        node.toggle()
+        answer = va.compile(shared=True)
+        utilities.diff(saved[0], answer)
+        saved[0] = answer
+    results['toggle_autosave'] = measure(autosave, toggled, args.repeat)
+
+    results['validate'] = measure(va.validate, answers, args.repeat)
+    # reindex drops the cached validator, so every call generates the code again
+    results['compile_validator'] = measure(
+        lambda _: va.compile_validator(), range(args.builds), args.repeat, prepare=lambda _: va.reindex())
+    results['compiled_validate'] = measure(va.compile_validator(), answers, args.repeat)
+    results['get_validation_errors'] = measure(va.get_validation_errors, answers, args.repeat)
+    results['querySelector'] = measure(
+        lambda i: Annotation.querySelector(answers[i], selectors[i]), range(len(answers)), args.repeat)
+    results['queryMetadata'] = measure(va.queryMetadata, selectors, args.repeat)
+    results['divergence'] = measure(lambda p: utilities.divergence(p[0], p[1]), pairs, args.repeat)
+    # answers prepared once and the cache primed, as when the same answers
+    # are compared again (e.g. agreement over every pair of a pool)
+    cache = utilities.DivergenceCache()
+    prepared = [(cache.prepare(a), cache.prepare(b)) for a, b in pairs]
+    for a, b in prepared:
+        cache.divergence(a, b)
+    results['divergence_cached'] = measure(lambda p: cache.divergence(p[0], p[1]), prepared, args.repeat)
+    results['divergence_prepare'] = measure(cache.prepare, answers, args.repeat)
+    results['canonicalize'] = measure(va.canonicalize, answers, args.repeat)
+    results['content_hash'] = measure(utilities.content_hash, answers, args.repeat)
+
+    return {
+        'version': vulcan_annotation.__version__,
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'params': {
+            'depth': args.depth,
+            'fanout': args.fanout,
+            'mix': { str(k): v for k, v in mix.items() },
+            'answers': args.answers,
+            'builds': args.builds,
+            'repeat': args.repeat,
+            'select_rate': args.select_rate,
+            'seed': args.seed,
+        },
+        'category': {
+            'nodes': va.node_count,
+            'max_size': va.max_size,
+        },
+        'results': results,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--depth', type=int, default=4)
+    parser.add_argument('--fanout', type=int, default=5)
+    parser.add_argument('--mix', default=None, help='input type weights, e.g. "mutual=2,multiple=1,text=1,none=1"')
+    parser.add_argument('--answers', type=int, default=1000)
+    parser.add_argument('--builds', type=int, default=20, help='trees built for the construction benchmark')
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--select-rate', type=float, default=0.5)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', default=None, help='write the results to this JSON file')
+    args = parser.parse_args(argv)
+
+    report = run(args)
+    for name, result in report['results'].items():
+        print("%-24s %12.2f us/call  (%d calls)" % (name, result['per_call_us'], result['calls']))
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+    return report
+
+
+if __name__ == '__main__':
+    main()
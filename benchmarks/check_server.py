@@ -0,0 +1,83 @@
+"""
+Smoke check of the server.py endpoints through the FastAPI TestClient.
+
+    pip install fastapi httpx
+    python benchmarks/check_server.py
+
+Runs the app with its process pool (startup and shutdown events included)
+against categories/car.json and exits with status 1 on the first failure.
+"""
+
+
+import json
+import os
+import random
+import sys
+
+root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, root)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+os.environ.setdefault("VULCAN_WORKERS", "2")
+
+from fastapi.testclient import TestClient
+
+import server
+from vulcan_annotation import Annotation
+from synthetic import generate_answer
+
+
+def check(client):
+    with open(os.path.join(root, "categories", "car.json")) as f:
+        category = json.load(f)
+    va = Annotation(category)
+    rng = random.Random(0)
+    answers = [generate_answer(category, rng) for _ in range(20)]
+    key = answers[0]["value"]["key"]
+
+    response = client.post("/api/car/validate", json={ "annotations": answers + [{ "key": "bogus" }, 5] })
+    assert response.status_code == 200, response.text
+    assert response.json()["results"] == [True] * len(answers) + [False, False]
+
+    response = client.post("/api/car/compile-errors", json={ "annotations": answers[:2] })
+    assert response.status_code == 200, response.text
+    assert len(response.json()["results"]) == 2
+
+    response = client.post("/api/divergence", json={ "pairs": [[answers[0], answers[0]], [answers[0], None]] })
+    assert response.json()["results"] == [0, 1]
+
+    # queries over answers, the first match and every match
+    response = client.post("/api/car/query", json={ "selector": key, "annotations": answers[:3] })
+    assert response.status_code == 200, response.text
+    assert response.json()["results"] == [Annotation.querySelector(a, key) for a in answers[:3]]
+    response = client.post("/api/car/query", json={ "selector": key, "annotations": answers[:3], "all": True })
+    assert response.status_code == 200, response.text
+    assert response.json()["results"] == [list(Annotation.querySelectorAll(a, key)) for a in answers[:3]]
+
+    # queries over the category metadata
+    response = client.post("/api/car/query", json={ "selector": "car.metadata" })
+    assert response.json()["result"] == va.queryMetadata("car.metadata")
+    response = client.post("/api/car/query", json={ "selector": "car", "all": True })
+    assert response.status_code == 200, response.text
+    assert response.json()["result"] == [n.to_category() for n in va.queryMetadataAll("car")]
+
+    assert client.post("/api/car/query", json={ "selector": "a >" }).status_code == 400
+    assert client.post("/api/missing/validate", json={ "annotations": [] }).status_code == 404
+
+    stats = client.get("/api/stats").json()["endpoints"]
+    assert stats["validate"]["items"] == len(answers) + 2
+
+    response = client.get("/src/vulcan_annotation.js", headers={ "accept-encoding": "gzip" })
+    assert response.status_code == 200
+    response = client.get("/src/vulcan_annotation.js", headers={ "if-none-match": response.headers["etag"] })
+    assert response.status_code == 304
+
+
+def main():
+    with TestClient(server.app) as client:
+        check(client)
+    print("server endpoints ok")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
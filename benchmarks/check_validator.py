@@ -0,0 +1,96 @@
+"""
+Equivalence check between Annotation.validate and Annotation.compile_validator().
+
+    python benchmarks/check_validator.py --categories 200 --answers 50
+
+Random categories are generated with every input type, and each one is fed
+valid answers, mutated answers (edited text, dropped items) and corrupted
+answers (wrong keys, wrong value types, unknown items), both as plain and as
+value_first answers. Exits with status 1 on the first mismatch.
+"""
+
+
+import argparse
+import os
+import random
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from vulcan_annotation import Annotation
+from synthetic import generate_answers, generate_category, mutate_answer
+
+
+def corrupt_answer(answer, rng, rate=0.1):
+    # a copy of answer with keys, values and list items broken at random
+    corrupted = { "key": answer["key"] }
+    if rng.random() < rate:
+        corrupted["key"] = rng.choice(["bogus", None, 0])
+    if "value" not in answer:
+        if rng.random() < rate:
+            corrupted["value"] = "x"
+        return corrupted
+    value = answer["value"]
+    if rng.random() < rate:
+        corrupted["value"] = rng.choice([None, 1, "x", [], { "key": "bogus" }, { "key": None }])
+    elif isinstance(value, dict):
+        corrupted["value"] = corrupt_answer(value, rng, rate)
+    elif isinstance(value, list):
+        corrupted["value"] = [corrupt_answer(i, rng, rate) for i in value]
+        if rng.random() < rate:
+            corrupted["value"].append({ "key": "bogus" })
+        if corrupted["value"] and rng.random() < rate:
+            corrupted["value"].append(rng.choice(corrupted["value"]))
+    else:
+        corrupted["value"] = value
+    return corrupted
+
+
+def outcome(validate, annotation, value_first):
+    # the validators check siblings in a different order, so a malformed answer
+    # may raise in one and fail early in the other; like validate_many, count
+    # a raise as invalid
+    try:
+        return validate(annotation, value_first)
+    except (AttributeError, TypeError):
+        return False
+
+
+def check(args):
+    rng = random.Random(args.seed)
+    checked = 0
+    for seed in range(args.seed, args.seed + args.categories):
+        category = generate_category(rng.randint(1, args.depth), rng.randint(1, args.fanout),
+                                     required_rate=rng.random() * 0.5, seed=seed)
+        va = Annotation(category)
+        validator = va.compile_validator()
+        for answer in generate_answers(category, args.answers, rng.random(), seed=seed):
+            for candidate in [answer, mutate_answer(answer, rng, 0.3), corrupt_answer(answer, rng)]:
+                for value_first in [False, True]:
+                    annotation = candidate.get("value") if value_first else candidate
+                    expected = outcome(va.validate, annotation, value_first)
+                    actual = outcome(validator, annotation, value_first)
+                    checked += 1
+                    if expected != actual:
+                        print("mismatch for category seed %d: validate %r, compiled %r" % (seed, expected, actual))
+                        print("answer:", annotation, "value_first:", value_first)
+                        return checked, False
+    return checked, True
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--categories', type=int, default=200)
+    parser.add_argument('--answers', type=int, default=50)
+    parser.add_argument('--depth', type=int, default=5)
+    parser.add_argument('--fanout', type=int, default=5)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args(argv)
+
+    checked, ok = check(args)
+    print("%d answers checked, %s" % (checked, "all equal" if ok else "MISMATCH"))
+    return 0 if ok else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
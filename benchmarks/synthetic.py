@@ -0,0 +1,97 @@
+import random
+
+
+# synthetic categories and answers for the benchmarks; everything is driven
+# by a seeded random.Random so runs are reproducible
+
+DEFAULT_MIX = {
+    "mutual": 2,
+    "multiple": 2,
+    "property": 1,
+    "text": 1,
+    None: 1,
+}
+
+
+def parse_mix(text):
+    # "mutual=2,multiple=1,text=1,none=1" -> { "mutual": 2, ..., None: 1 }
+    mix = {}
+    for part in text.split(","):
+        name, _, weight = part.partition("=")
+        name = name.strip()
+        mix[None if name in ["none", "None", ""] else name] = float(weight or 1)
+    return mix
+
+
+def generate_category(depth=4, fanout=5, mix=None, required_rate=0.2, seed=0):
+    rng = random.Random(seed)
+    mix = DEFAULT_MIX if mix is None else mix
+    branch_types = [t for t in mix if t not in ["text", None]]
+    leaf_types = [t for t in mix if t in ["text", None]] or [None]
+
+    def pick(types):
+        return rng.choices(types, weights=[mix.get(t, 1) for t in types])[0]
+
+    def node(key, level):
+        category = { "key": key }
+        input_type = pick(list(mix)) if level < depth else pick(leaf_types)
+        if input_type is not None:
+            category["inputType"] = input_type
+        if rng.random() < required_rate:
+            category["required"] = True
+        if input_type in branch_types:
+            category["choices"] = [
+                node("%s_%d" % (key, i) if key else "n%d" % i, level + 1)
+                for i in range(fanout)
+            ]
+        return category
+
+    root = node(None, 1)
+    if "choices" not in root:
+        root = { "key": None, "inputType": "multiple", "choices": [node("n0", 2)] }
+    return root
+
+
+def generate_answer(category, rng, select_rate=0.5, text_length=8):
+    # a valid answer to category, as produced by Annotation.compile()
+    input_type = category.get("inputType")
+    answer = { "key": category.get("key") }
+    if input_type == "text":
+        answer["value"] = "".join(rng.choice("abcdefghij") for _ in range(rng.randint(0, text_length)))
+    elif input_type == "mutual":
+        answer["value"] = generate_answer(rng.choice(category["choices"]), rng, select_rate, text_length)
+    elif input_type == "property":
+        answer["value"] = [
+            generate_answer(c, rng, select_rate, text_length)
+            for c in category["choices"]
+        ]
+    elif input_type == "multiple":
+        answer["value"] = [
+            generate_answer(c, rng, select_rate, text_length)
+            for c in category["choices"]
+            if c.get("required") or rng.random() < select_rate
+        ]
+    return answer
+
+
+def generate_answers(category, count, select_rate=0.5, text_length=8, seed=0):
+    rng = random.Random(seed)
+    return [generate_answer(category, rng, select_rate, text_length) for _ in range(count)]
+
+
+def mutate_answer(answer, rng, rate=0.1):
+    # a copy of answer with some text values edited and list items dropped,
+    # usually still valid unless a required item is dropped
+    mutated = { "key": answer["key"] }
+    if "value" not in answer:
+        return mutated
+    value = answer["value"]
+    if isinstance(value, str):
+        mutated["value"] = value + "x" if rng.random() < rate else value
+    elif isinstance(value, dict):
+        mutated["value"] = mutate_answer(value, rng, rate)
+    elif isinstance(value, list):
+        mutated["value"] = [mutate_answer(i, rng, rate) for i in value if rng.random() >= rate]
+    else:
+        mutated["value"] = value
+    return mutated
@@ -1,25 +1,359 @@
-from fastapi import FastAPI
-from fastapi.staticfiles import StaticFiles
+from fastapi import FastAPI, HTTPException, Request, Response
+from pydantic import BaseModel
+from typing import Any, List, Optional, Tuple
+from concurrent.futures import ProcessPoolExecutor
+import asyncio
+import gzip
+import hashlib
+import mimetypes
 import os
+import time
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+from vulcan_annotation import Annotation, AnnotationState, compile_selector, load_category, utilities
 
 dir_path = os.path.dirname(os.path.realpath(__file__))
+category_path = os.path.join(dir_path, "categories")
+
+# answers per task sent to the worker pool
+CHUNK_SIZE = 500
 
 
 app = FastAPI()
+app.state.pool = None
+
+
+# ---- worker side: everything below runs in the process pool ----
+
+def _validate_chunk(annotations, path, value_first, errors):
+    return list(load_category(path).validate_many(annotations, value_first, errors=errors))
+
+
+def _key_path(node):
+    path = []
+    while node.parent is not None:
+        path.append(node.key)
+        node = node.parent
+    path.reverse()
+    return path
+
+
+def _compile_errors_chunk(annotations, path, value_first):
+    state = AnnotationState(load_category(path))
+    results = []
+    for a in annotations:
+        try:
+            state.decompile(a, value_first)
+        except (AttributeError, TypeError):
+            results.append([{ 'path': [], 'error': -5 }])
+            continue
+        results.append([
+            { 'path': _key_path(e['node']), 'error': e['error'] }
+            for e in state.get_compile_errors()
+        ])
+    return results
+
+
+def _divergence_chunk(pairs, max_distance):
+    if max_distance is None:
+        return [utilities.divergence(a, b) for a, b in pairs]
+    return [utilities.divergence_within(a, b, max_distance) for a, b in pairs]
+
+
+def _query_chunk(annotations, selector, all):
+    results = []
+    for a in annotations:
+        try:
+            if all:
+                # querySelectorAll is lazy, a generator cannot leave the worker
+                results.append(list(Annotation.querySelectorAll(a, selector)))
+            else:
+                results.append(Annotation.querySelector(a, selector))
+        except (AttributeError, TypeError):
+            results.append(None)
+    return results
+
+
+# ---- service side ----
+
+class EndpointStats:
+
+    def __init__(self):
+        self.requests = 0
+        self.items = 0
+        self.busy = 0.0
+        self.max_latency = 0.0
+
+    def add(self, items, latency):
+        self.requests += 1
+        self.items += items
+        self.busy += latency
+        self.max_latency = max(self.max_latency, latency)
+
+    def to_dict(self):
+        return {
+            'requests': self.requests,
+            'items': self.items,
+            'mean_latency_ms': self.busy / self.requests * 1e3 if self.requests else 0.0,
+            'max_latency_ms': self.max_latency * 1e3,
+            'items_per_second': self.items / self.busy if self.busy > 0 else 0.0,
+        }
+
+
+stats = {}
+started = time.time()
+
+
+def _chunks(items):
+    return [items[i:i + CHUNK_SIZE] for i in range(0, len(items), CHUNK_SIZE)]
+
+
+async def _offload(endpoint, func, items, *args):
+    # split the batch into chunks, run them on the pool and join the results
+    # in order; without a pool (startup not run) the default executor is used
+    start = time.perf_counter()
+    loop = asyncio.get_running_loop()
+    results = await asyncio.gather(*[
+        loop.run_in_executor(app.state.pool, func, chunk, *args)
+        for chunk in _chunks(items)
+    ])
+    stats.setdefault(endpoint, EndpointStats()).add(len(items), time.perf_counter() - start)
+    return [r for chunk in results for r in chunk]
+
+
+def _jsonable(result):
+    # selectors without a field (or with .choices) return category nodes
+    if isinstance(result, Annotation):
+        return result.to_category()
+    if isinstance(result, list):
+        return [_jsonable(r) for r in result]
+    return result
+
+
+def _category_file(name):
+    path = os.path.join(category_path, name + ".json")
+    if os.path.basename(name) != name or not os.path.isfile(path):
+        raise HTTPException(status_code=404, detail="Category %s not found." % name)
+    return path
+
+
+class Asset:
+
+    def __init__(self, content, stat):
+        self.stat_key = (stat.st_mtime_ns, stat.st_size)
+        self.etag = hashlib.sha256(content).hexdigest()[:32]
+        # encoding -> body; a variant is only kept when it is smaller
+        self.bodies = { 'identity': content }
+        if len(content) >= 256:
+            self.__add_variant('gzip', gzip.compress(content, 9, mtime=0))
+            if brotli is not None:
+                self.__add_variant('br', brotli.compress(content, quality=11))
+
+    def __add_variant(self, encoding, body):
+        if len(body) < len(self.bodies['identity']):
+            self.bodies[encoding] = body
+
+    def variant_etag(self, encoding):
+        return '"%s"' % self.etag if encoding == 'identity' else '"%s-%s"' % (self.etag, encoding)
+
+
+class AssetCache:
+
+    # files of a directory held in memory together with their compressed
+    # variants, reloaded when the file mtime or size changes
+
+    def __init__(self, directory):
+        self.directory = os.path.realpath(directory)
+        self.__assets = {}
+
+    def get(self, path):
+        full_path = os.path.realpath(os.path.join(self.directory, path))
+        if os.path.commonpath([full_path, self.directory]) != self.directory:
+            return None
+        try:
+            stat = os.stat(full_path)
+        except OSError:
+            return None
+        if not os.path.isfile(full_path):
+            return None
+        asset = self.__assets.get(full_path)
+        if asset is None or asset.stat_key != (stat.st_mtime_ns, stat.st_size):
+            with open(full_path, "rb") as f:
+                asset = Asset(f.read(), stat)
+            self.__assets[full_path] = asset
+        return asset
+
+
+def _accepted_encodings(header):
+    # "gzip, br;q=0.8" -> { "gzip", "br" }, dropping anything with q=0
+    accepted = set()
+    for part in header.split(","):
+        token, *params = [p.strip() for p in part.split(";")]
+        q = 1.0
+        for param in params:
+            name, _, value = param.partition("=")
+            if name.strip() == "q":
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        if token and q > 0:
+            accepted.add(token.lower())
+    return accepted
+
+
+def _not_modified(header, asset):
+    # any encoding variant of the same content revalidates
+    for tag in header.split(","):
+        tag = tag.strip()
+        if tag == "*":
+            return True
+        if tag.startswith("W/"):
+            tag = tag[2:]
+        tag = tag.strip('"')
+        if tag == asset.etag or tag.startswith(asset.etag + "-"):
+            return True
+    return False
+
+
+def serve_asset(cache, path, request):
+    asset = cache.get(path)
+    if asset is None:
+        raise HTTPException(status_code=404, detail="Not Found")
+
+    accepted = _accepted_encodings(request.headers.get("accept-encoding", ""))
+    encoding = next((e for e in ['br', 'gzip']
+                     if e in asset.bodies and (e in accepted or '*' in accepted)), 'identity')
+    headers = {
+        'ETag': asset.variant_etag(encoding),
+        'Vary': 'Accept-Encoding',
+        # urls carrying the content hash (?v=<etag>) never change; anything
+        # else is cached too but revalidated, which is a cheap 304
+        'Cache-Control': 'public, max-age=31536000, immutable'
+        if request.query_params.get('v') == asset.etag else 'public, no-cache',
+    }
+    if _not_modified(request.headers.get("if-none-match", ""), asset):
+        return Response(status_code=304, headers=headers)
+
+    if encoding != 'identity':
+        headers['Content-Encoding'] = encoding
+    media_type = mimetypes.guess_type(path)[0] or "application/octet-stream"
+    body = asset.bodies[encoding]
+    if request.method == "HEAD":
+        headers['Content-Length'] = str(len(body))
+        body = b""
+    return Response(content=body, media_type=media_type, headers=headers)
+
+
+category_assets = AssetCache(category_path)
+js_assets = AssetCache(os.path.join(dir_path, "js"))
+
+
+class ValidateRequest(BaseModel):
+    annotations: List[Any]
+    value_first: bool = False
+    errors: bool = False
+
+
+class CompileErrorsRequest(BaseModel):
+    annotations: List[Any]
+    value_first: bool = False
+
+
+class DivergenceRequest(BaseModel):
+    pairs: List[Tuple[Any, Any]]
+    max_distance: Optional[int] = None
+
+
+class QueryRequest(BaseModel):
+    selector: str
+    # answers to query; without them the selector is matched against the
+    # category and the metadata of the matched nodes is returned
+    annotations: Optional[List[Any]] = None
+    all: bool = False
 
 
 @ app.on_event("startup")
 async def startup_event():
     print("Test is starting up.")
+    workers = int(os.environ.get("VULCAN_WORKERS", 0)) or None
+    app.state.pool = ProcessPoolExecutor(max_workers=workers)
 
 
 @ app.on_event("shutdown")
 def shutdown_event():
     print("Test is exiting.", "Wait a moment until completely exits.")
+    if app.state.pool is not None:
+        app.state.pool.shutdown(wait=True)
+        app.state.pool = None
+
+
+@ app.post("/api/{category}/validate")
+async def validate(category: str, request: ValidateRequest):
+    path = _category_file(category)
+    results = await _offload("validate", _validate_chunk, request.annotations,
+                             path, request.value_first, request.errors)
+    return { 'results': results }
+
+
+@ app.post("/api/{category}/compile-errors")
+async def compile_errors(category: str, request: CompileErrorsRequest):
+    path = _category_file(category)
+    results = await _offload("compile-errors", _compile_errors_chunk, request.annotations,
+                             path, request.value_first)
+    return { 'results': results }
+
+
+@ app.post("/api/{category}/query")
+async def query(category: str, request: QueryRequest):
+    path = _category_file(category)
+    try:
+        compile_selector(request.selector)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if request.annotations is None:
+        # a metadata lookup on the cached tree is cheap, no need for the pool
+        start = time.perf_counter()
+        tree = load_category(path)
+        if request.all:
+            result = [_jsonable(r) for r in tree.queryMetadataAll(request.selector)]
+        else:
+            result = _jsonable(tree.queryMetadata(request.selector))
+        stats.setdefault("query", EndpointStats()).add(1, time.perf_counter() - start)
+        return { 'result': result }
+    results = await _offload("query", _query_chunk, request.annotations,
+                             request.selector, request.all)
+    return { 'results': results }
+
+
+@ app.post("/api/divergence")
+async def divergence(request: DivergenceRequest):
+    results = await _offload("divergence", _divergence_chunk, request.pairs,
+                             request.max_distance)
+    return { 'results': results }
+
+
+@ app.get("/api/stats")
+async def get_stats():
+    return {
+        'uptime_s': time.time() - started,
+        'endpoints': { name: s.to_dict() for name, s in stats.items() },
+    }
+
+
+@ app.api_route("/category/{path:path}", methods=["GET", "HEAD"])
+async def get_category(path: str, request: Request):
+    return serve_asset(category_assets, path, request)
 
 
-app.mount("/category", StaticFiles(directory="categories"))
-app.mount("/", StaticFiles(directory="js"))
+# registered last, it matches every other path
+@ app.api_route("/{path:path}", methods=["GET", "HEAD"])
+async def get_js(path: str, request: Request):
+    return serve_asset(js_assets, path, request)
 
 
 if __name__ == '__main__':
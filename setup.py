@@ -64,5 +64,8 @@ setup(
     install_requires=[
         "shortuuid",
         "levenshtein"
-    ]
+    ],
+    extras_require={
+        "numpy": ["numpy"]
+    }
 )
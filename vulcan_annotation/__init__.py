@@ -1,7 +1,13 @@
 from .annotation import Annotation
+from .selector import Selector, compile_selector
+from .state import AnnotationState
+from .loader import CategoryCache, load_category
 from . import utilities
+from . import aggregation
+from . import stream
 
 import os
+from functools import lru_cache
 from importlib.metadata import version
 from importlib.resources import files
 
@@ -9,6 +15,8 @@ from importlib.resources import files
 __version__ = version('vulcan_annotation')
 
 
+# the assets ship with the package and do not change while it is loaded
+@lru_cache(maxsize=None)
 def load_js():
     # files(__name__) locates the current package
     # .joinpath navigates into the 'js' subdirectory
@@ -16,5 +24,6 @@ def load_js():
     return files(__name__).joinpath('js', 'vulcan_annotation.js').read_text()
 
 
+@lru_cache(maxsize=None)
 def load_va_dom():
     return files(__name__).joinpath('js', 'va_dom.js').read_text()
\ No newline at end of file
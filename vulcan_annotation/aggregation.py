@@ -0,0 +1,139 @@
+from .utilities import divergence
+
+
+def _medoid(fragments):
+    # the text answer with the least total divergence to all the others
+    best = None
+    best_div = None
+    for f in fragments:
+        div = sum([divergence(f, g) for g in fragments])
+        if best_div is None or div < best_div:
+            best = f
+            best_div = div
+    return best
+
+
+def _consensus(node, fragments):
+    # fragments are the answers of the annotators who selected node
+    if node.inputType == "text":
+        texts = [f for f in fragments if isinstance(f.get('value'), str)]
+        if not texts:
+            return { 'key': node.key, 'value': None }
+        return { 'key': node.key, 'value': _medoid(texts)['value'] }
+    elif node.inputType == "mutual":
+        votes = {}
+        for f in fragments:
+            value = f.get('value')
+            if isinstance(value, dict) and value.get('key') in node.child_map:
+                votes.setdefault(value.get('key'), []).append(value)
+        winner = None
+        for c in node.children:
+            if c.key in votes and (winner is None or len(votes[c.key]) > len(votes[winner.key])):
+                winner = c
+        if winner is None:
+            return { 'key': node.key, 'value': None }
+        return { 'key': node.key, 'value': _consensus(winner, votes[winner.key]) }
+    elif node.inputType in ["multiple", "property"]:
+        votes = {}
+        for f in fragments:
+            value = f.get('value')
+            if not isinstance(value, list):
+                continue
+            # an annotator votes at most once per choice
+            items = {
+                i.get('key'): i
+                for i in value
+                if isinstance(i, dict) and i.get('key') in node.child_map
+            }
+            for key, item in items.items():
+                votes.setdefault(key, []).append(item)
+        value = []
+        for c in node.children:
+            items = votes.get(c.key)
+            if not items:
+                continue
+            if node.inputType == "property" or c.required or 2 * len(items) > len(fragments):
+                value.append(_consensus(c, items))
+        return { 'key': node.key, 'value': value }
+    else:
+        return { 'key': node.key }
+
+
+def aggregate(category, answers, value_first=False):
+    # consensus of many answers to the same item: majority choice for mutual,
+    # per-choice majority for multiple, every answered choice for property
+    # and the medoid text by divergence for text
+    if value_first:
+        fragments = [{ 'key': category.key, 'value': a } for a in answers if a is not None]
+    else:
+        fragments = [a for a in answers if a is not None and a.get('key') == category.key]
+    if not fragments:
+        return None
+    result = _consensus(category, fragments)
+    return result.get('value') if value_first else result
+
+
+def aggregate_many(category, items, value_first=False):
+    # items is an iterable of answer lists, one list per item; consensus
+    # answers are yielded one at a time so only one item is held in memory
+    for answers in items:
+        yield aggregate(category, answers, value_first)
+
+
+if __name__ == '__main__':
+    from vulcan_annotation import Annotation
+
+    va = Annotation({
+        "key": "car",
+        "inputType": "multiple",
+        "choices": [
+        {
+            "key": "type",
+            "inputType": "mutual",
+            "choices": [{ "key": "sedan" }, { "key": "truck" }, { "key": "bus" }]
+        },
+        {
+            "key": "lp_text",
+            "inputType": "text"
+        },
+        {
+            "key": "damaged"
+        },
+        {
+            "key": "color",
+            "required": True,
+            "inputType": "text"
+        }]
+    })
+
+    def answer(*items):
+        return { "key": "car", "value": list(items) }
+
+    def choose(key):
+        return { "key": "type", "value": { "key": key } }
+
+    def text(key, value):
+        return { "key": key, "value": value }
+
+    # mutual: plurality, a tie goes to the earlier choice of the category
+    result = aggregate(va, [answer(choose("truck")), answer(choose("bus")), answer(choose("truck"))])
+    assert(result == answer({ "key": "type", "value": { "key": "truck" } }))
+    result = aggregate(va, [answer(choose("bus")), answer(choose("truck"))])
+    assert(result["value"][0]["value"] == { "key": "truck" })
+
+    # multiple: a choice needs a strict majority of the annotators, a
+    # required choice is kept by any vote
+    damaged = { "key": "damaged" }
+    assert(aggregate(va, [answer(damaged), answer(damaged), answer()]) == answer(damaged))
+    assert(aggregate(va, [answer(damaged), answer()]) == answer())
+    assert(aggregate(va, [answer(text("color", "red")), answer(), answer()]) == answer(text("color", "red")))
+
+    # text: the answer closest to all the others
+    result = aggregate(va, [answer(text("lp_text", t)) for t in ["1234", "1284", "1234", "9999"]])
+    assert(result == answer(text("lp_text", "1234")))
+
+    # value_first answers, missing answers and an item nobody answered
+    assert(aggregate(va, [[damaged], None, [damaged]], value_first=True) == [damaged])
+    assert(aggregate(va, []) is None)
+    assert(aggregate(va, [None, { "key": "bus" }]) is None)
+    assert(list(aggregate_many(va, [[answer(damaged)], []])) == [answer(damaged), None])
@@ -6,41 +6,239 @@ changed: added max_size
 import json
 import os
 import shortuuid
+from collections import deque
+from contextlib import contextmanager
+from concurrent.futures import ProcessPoolExecutor
+from itertools import islice
+
+try:
+    from .codegen import compile_validator
+    from .selector import compile_selector
+except ImportError:
+    # run as a script: python vulcan_annotation/annotation.py
+    from codegen import compile_validator
+    from selector import compile_selector
 
 
 class Annotation:
 
+    # no per-node __dict__: a session keeps one tree alive per open task
+    __slots__ = (
+        '__id', 'parent', 'inputType', 'required', 'key', 'description',
+        'metadata', '__is_selected', '__on_select', '__data', '__on_data', 'index',
+        'children', 'child_map', 'required_children', 'max_size', '__index',
+        'ordinal', 'node_count', '__compiled', '__dirty', '__batch',
+        '__batch_depth', '__on_change', '__listeners', '__validator'
+    )
+
     def __init__(self, category, parent = None):
-        self.id = shortuuid.uuid()
+        self.__setup(category, parent)
+
+        # build the subtree with an explicit stack so that deep categories
+        # are not limited by the recursion limit
+        nodes = []
+        stack = [(self, category)]
+        while stack:
+            node, node_category = stack.pop()
+            nodes.append(node)
+            if node.inputType and node.inputType != "text":
+                node.children = []
+                for choice in node_category['choices']:
+                    child = Annotation.__new__(type(self))
+                    child.__setup(choice, node)
+                    node.children.append(child)
+                    stack.append((child, choice))
+            else:
+                node.children = None
+
+        # children before their parents
+        for node in reversed(nodes):
+            node.__compile_schema()
+        if parent is None:
+            self.__number()
+
+    def __setup(self, category, parent):
+        self.__id = None
         self.parent = parent
         self.inputType = category.get('inputType')
         self.required = category.get('required', False)
         self.key = category.get('key')
         self.description = category.get('description', "")
         self.metadata = category.get('metadata')
-        self.is_selected = False
-        self.on_select = None
-        self.data = None
-        self.on_data = None
-
-        if self.inputType and self.inputType != "text":
-            self.children = []
-            sum_child_size = 0
-            max_child_size = 0
-            for choice in category['choices']:
-                child = Annotation(choice, self)
-                self.children.append(child)
-                child.parent = self
-                sum_child_size += child.max_size
-                if child.max_size > max_child_size:
-                    max_child_size = child.max_size
-            if self.inputType == "mutual":
-                self.max_size = 1 + max_child_size
-            else: # multiple or property
-                self.max_size = 1 + sum_child_size
-        else:
-            self.children = None
+        self.__is_selected = False
+        self.__on_select = None
+        self.__data = None
+        self.__on_data = None
+        self.__compiled = None
+        self.__dirty = True
+        self.__batch = None
+        self.__batch_depth = 0
+        self.__on_change = None
+        self.__listeners = 0
+        self.__validator = None
+
+        self.index = 0
+        self.ordinal = 0
+
+
+    @property
+    def id(self):
+        # generated on first use, most nodes never need one
+        if self.__id is None:
+            self.__id = shortuuid.uuid()
+        return self.__id
+
+    @id.setter
+    def id(self, value):
+        self.__id = value
+
+    @property
+    def is_selected(self):
+        return self.__is_selected
+
+    @is_selected.setter
+    def is_selected(self, value):
+        # a direct write invalidates the cached answer, like set/unset do
+        self.__is_selected = value
+        self.__mark_dirty()
+
+    @property
+    def data(self):
+        return self.__data
+
+    @data.setter
+    def data(self, value):
+        self.__data = value
+        self.__mark_dirty()
+
+    @property
+    def on_select(self):
+        return self.__on_select
+
+    @on_select.setter
+    def on_select(self, on_select):
+        self.__listen(self.__on_select, on_select)
+        self.__on_select = on_select
+
+    @property
+    def on_data(self):
+        return self.__on_data
+
+    @on_data.setter
+    def on_data(self, on_data):
+        self.__listen(self.__on_data, on_data)
+        self.__on_data = on_data
+
+    @property
+    def on_change(self):
+        return self.__on_change
+
+    @on_change.setter
+    def on_change(self, on_change):
+        self.__listen(self.__on_change, on_change)
+        self.__on_change = on_change
+
+    def __compile_schema(self):
+        # key -> child lookup and required children, built once so that
+        # validate/decompile/traverse never scan the choices per item
+        self.__index = None
+        self.__validator = None
+        self.__dirty = True
+        if self.children is None:
+            self.child_map = None
+            self.required_children = None
             self.max_size = 1
+            self.node_count = 1
+            return
+        for i, child in enumerate(self.children):
+            child.index = i
+            child.parent = self
+        self.child_map = { c.key: c for c in self.children }
+        if self.inputType == "property":
+            self.required_children = list(self.children)
+        else:
+            self.required_children = [c for c in self.children if c.required]
+        if self.inputType == "mutual":
+            self.max_size = 1 + max([c.max_size for c in self.children], default=0)
+        else: # multiple or property
+            self.max_size = 1 + sum([c.max_size for c in self.children])
+        self.node_count = 1 + sum([c.node_count for c in self.children])
+
+    def __number(self):
+        # depth-first ordinals, so a subtree spans ordinal .. ordinal + node_count - 1;
+        # the callbacks are counted again, a grafted subtree may bring its own
+        listeners = 0
+        for ordinal, node in enumerate(self.iter_nodes()):
+            node.ordinal = ordinal
+            listeners += node.__on_select is not None
+            listeners += node.__on_data is not None
+            listeners += node.__on_change is not None
+        self.__listeners = listeners
+
+    def iter_nodes(self):
+        # depth-first pre-order over the subtree, without recursion
+        stack = [self]
+        while stack:
+            node = stack.pop()
+            yield node
+            if node.children:
+                stack.extend(reversed(node.children))
+
+    def __post_order(self, visit):
+        # nodes reached through visit(node) -> children, children first
+        order = []
+        stack = [self]
+        while stack:
+            node = stack.pop()
+            order.append(node)
+            stack.extend(visit(node))
+        order.reverse()
+        return order
+
+    def reindex(self):
+        # call after mutating self.children so that the key lookups, sizes,
+        # ordinals and query indexes of this node and its ancestors are rebuilt
+        node = self
+        while True:
+            node.__compile_schema()
+            if node.parent is None:
+                break
+            node = node.parent
+        node.__number()
+
+    def __get_index(self):
+        # key -> nodes of this subtree in depth-first order, for queryMetadata
+        if self.__index is None:
+            index = {}
+            for node in self.iter_nodes():
+                index.setdefault(node.key, []).append(node)
+            self.__index = index
+        return self.__index
+
+    def __lookup(self, key_path):
+        # nodes matching "k1 > k2 > ... > kn" in the order a depth-first
+        # search from self would reach them
+        for node in self.__get_index().get(key_path[-1], []):
+            start = node
+            for key in reversed(key_path[:-1]):
+                if start is self:
+                    start = None
+                    break
+                start = start.parent
+                if start.key != key:
+                    start = None
+                    break
+            if start is None:
+                continue
+            # the search commits to the first node matching the leading key,
+            # so a start below another such node is never reached
+            ancestor = start
+            while ancestor is not self:
+                ancestor = ancestor.parent
+                if ancestor.key == key_path[0]:
+                    break
+            else:
+                yield node
 
 
     def set_on_data(self, on_data):
@@ -49,16 +247,89 @@ class Annotation:
     def set_on_select(self, on_select):
         self.on_select = on_select
 
+    def set_on_change(self, on_change):
+        # receives { node: { 'selected': ..., 'data': ... } } once per batch
+        self.on_change = on_change
+
+    def __get_root(self):
+        node = self
+        while node.parent is not None:
+            node = node.parent
+        return node
+
+    def __listen(self, old, new):
+        # the root counts the callbacks set in its tree; without any, batches
+        # skip recording the changes nobody would be told about
+        root = self.__get_root()
+        root.__listeners += (new is not None) - (old is not None)
+        if root.__listeners and root.__batch_depth > 0 and root.__batch is None:
+            root.__batch = {}
+
+    def __touch(self, batch):
+        # remember the state a node had when the batch started
+        if batch is not None and self not in batch:
+            batch[self] = (self.is_selected, self.data)
+
+    def begin_batch(self):
+        # hold back on_select/on_data until the matching end_batch
+        root = self.__get_root()
+        if root.__batch_depth == 0:
+            root.__batch = {} if root.__listeners else None
+        root.__batch_depth += 1
+
+    def end_batch(self):
+        root = self.__get_root()
+        root.__batch_depth -= 1
+        if root.__batch_depth > 0:
+            return
+        batch = root.__batch
+        root.__batch = None
+        if batch is None:
+            return
+        changes = {}
+        # reported in depth-first order, whatever order they were changed in
+        for node in sorted(batch, key=lambda node: node.ordinal):
+            was_selected, old_data = batch[node]
+            if node.is_selected == was_selected and node.data == old_data:
+                continue
+            changes[node] = { 'selected': node.is_selected, 'data': node.data }
+            if node.on_select and node.is_selected != was_selected:
+                node.on_select(node.is_selected)
+            if node.on_data and node.data != old_data:
+                node.on_data(node.data)
+        if changes and root.on_change:
+            root.on_change(changes)
+
+    @contextmanager
+    def batch(self):
+        # callbacks of a bulk edit are coalesced into one change per node
+        self.begin_batch()
+        try:
+            yield self
+        finally:
+            self.end_batch()
+
     def toggle(self):
         if self.is_selected:
             self.unset()
         else:
             self.set()
 
+    def __mark_dirty(self):
+        # a compiled fragment is cached per node; any change invalidates the
+        # fragments from this node up to the root
+        node = self
+        while node is not None:
+            node.__dirty = True
+            node = node.parent
+
     def set(self, data=None):
-        self.is_selected = True
+        batch = self.__get_root().__batch
+        self.__touch(batch)
+        self.__is_selected = True
+        self.__mark_dirty()
         if self.inputType == "text":
-            self.data = data
+            self.__data = data
         elif self.inputType == "mutual":
             for child in self.children:
                 if data is None or child.key != data:
@@ -69,186 +340,398 @@ class Annotation:
             for child in self.parent.children:
                 if child.is_selected and child != self:
                     child.unset()
-        if self.on_select:
-            self.on_select(self.is_selected)
-        if self.on_data:
-            self.on_data(self.data)
+        if batch is None:
+            if self.on_select:
+                self.on_select(self.is_selected)
+            if self.on_data:
+                self.on_data(self.data)
 
     def unset(self):
-        self.is_selected = False
-        self.data = None
-        if self.children:
-            for child in self.children:
-                child.unset()
-        if self.on_select:
-            self.on_select(self.is_selected)
+        root = self.__get_root()
+        batch = root.__batch
+        # only the nodes whose state changes are recorded and rebuilt
+        stack = [self]
+        while stack:
+            node = stack.pop()
+            if node.__is_selected or node.__data is not None:
+                if batch is not None:
+                    node.__touch(batch)
+                node.__is_selected = False
+                node.__data = None
+                node.__dirty = True
+            if node.children:
+                stack.extend(node.children)
+        self.__mark_dirty()
+        if batch is None and root.__listeners:
+            # children are reported before their parents
+            for node in self.__post_order(lambda node: node.children or []):
+                if node.on_select:
+                    node.on_select(node.is_selected)
 
 
     def set_bubble(self, data=None):
-        self.is_selected = True
+        batch = self.__get_root().__batch
+        self.__touch(batch)
+        self.__is_selected = True
+        self.__dirty = True
         if self.inputType == "text":
-            self.data = data
+            self.__data = data
         elif self.inputType == "mutual" and data is not None:
             for child in self.children:
                 if child.key != data:
                     child.unset()
                 else:
                     child.set()
-        if self.parent is not None:
-            self.parent.set_bubble()
+        node = self.parent
+        while node is not None:
+            node.__touch(batch)
+            node.__is_selected = True
+            node.__dirty = True
+            node = node.parent
 
 
     def __compile(self):
-        if not self.is_selected:
+        # only the dirty path is rebuilt, the rest of the answer is reused
+        # from the previous compile
+        if not self.__dirty:
+            return self.__compiled
+        dirty = lambda node: [
+            c for c in node.children
+            if c.__is_selected and c.__dirty
+        ] if node.__is_selected and node.children else []
+        for node in self.__post_order(dirty):
+            node.__compiled = node.__compile_fragment()
+            node.__dirty = False
+        return self.__compiled
+
+    def __compile_fragment(self):
+        # the fragments of the selected children are already up to date
+        if not self.__is_selected:
             return None
         if self.inputType == "text":
-            return { 'key': self.key, 'value': self.data }
+            return { 'key': self.key, 'value': self.__data }
         elif self.inputType == "mutual":
             for child in self.children:
-                if child.is_selected:
-                    return { 'key': self.key, 'value': child.__compile() }
+                if child.__is_selected:
+                    return { 'key': self.key, 'value': child.__compiled }
         elif self.inputType in ["multiple", "property"]:
             data = []
             for child in self.children:
-                if child.is_selected:
-                    cc = child.__compile()
+                if child.__is_selected:
+                    cc = child.__compiled
                     if cc is not None:
                         data.append(cc)
             return { 'key': self.key, 'value': data }
         elif self.inputType is None:
             return { 'key': self.key }
 
-    def compile(self, value_first=False):
+    def compile(self, value_first=False, shared=False):
+        # a new answer on every call; with shared=True the cached answer itself
+        # is returned, cheaper but its unchanged subtrees are shared with the
+        # results of later compiles, so it must be treated as read-only
         data_obj = self.__compile()
+        if not shared and data_obj is not None:
+            data_obj = _copy_answer(data_obj)
         if value_first:
             return data_obj.get('value')
         return data_obj
 
-    def __decompile(self, annotation):
-        self.is_selected = True
-        if self.inputType == "text":
-            self.data = annotation.get('value')
-        elif self.inputType in ["multiple", "property"]:
-            for item in annotation.get('value'):
-                for child in self.children:
-                    if item.get('key') == child.key:
-                        child.__decompile(item)
-        elif self.inputType == "mutual":
-            if annotation.get('value') is not None:
-                for child in self.children:
-                    if annotation.get('value').get('key') == child.key:
-                        child.__decompile(annotation.get('value'))
-                        break
-
-    def __fireevents(self):
-        if self.on_select:
-            self.on_select(True)
-        if self.inputType == "text":
-            if self.on_data:
-                self.on_data(self.data)
-        elif self.inputType in ["multiple", "property", "mutual"]:
-            for child in self.children:
-                if child.is_selected:
-                    child.__fireevents()
+    def __decompile(self, annotation, batch):
+        stack = [(self, annotation)]
+        while stack:
+            node, annotation = stack.pop()
+            if batch is not None:
+                node.__touch(batch)
+            node.__is_selected = True
+            node.__dirty = True
+            if node.inputType == "text":
+                node.__data = annotation.get('value')
+            elif node.inputType in ["multiple", "property"]:
+                for item in annotation.get('value'):
+                    child = node.child_map.get(item.get('key'))
+                    if child is not None:
+                        stack.append((child, item))
+            elif node.inputType == "mutual":
+                if annotation.get('value') is not None:
+                    child = node.child_map.get(annotation.get('value').get('key'))
+                    if child is not None:
+                        stack.append((child, annotation.get('value')))
 
     def decompile(self, annotation, value_first=False):
-        self.unset()
-        self.__decompile({ 'value': annotation } if value_first else annotation)
-        self.__fireevents()
+        # runs as one batch, so each node reports at most one change
+        self.begin_batch()
+        try:
+            self.unset()
+            self.__decompile({ 'value': annotation } if value_first else annotation,
+                             self.__get_root().__batch)
+        finally:
+            self.end_batch()
 
 
-    def __validate(self, annotation):
-        if annotation.get('key') != self.key:
-            return False
+    def __validate(self, stack):
+        # stack holds (node, answer) pairs still to be checked
+        while stack:
+            node, annotation = stack.pop()
+            if annotation.get('key') != node.key:
+                return False
+            if not node.__validate_value(annotation.get('value'), stack):
+                return False
+        return True
 
+    def __validate_value(self, value, stack):
+        # checks this node and pushes the (child, item) pairs to check next
         if self.inputType == "text":
-            if isinstance(annotation.get('value'), str):
-                return True
+            if not isinstance(value, str):
+                return False
         elif self.inputType == "property":
-            if not isinstance(annotation.get('value'), list):
+            if not isinstance(value, list):
                 return False
-            if len(annotation.get('value')) != len(self.children):
+            if len(value) != len(self.children):
                 return False
 
-            for c in self.children:
-                matched = None
-                for item in annotation.get('value'):
-                    if item.get('key') == c.key:
-                        matched = item
-                if matched is None or not c.__validate(matched):
+            items = { item.get('key'): item for item in value }
+            for c in self.required_children:
+                matched = items.get(c.key)
+                if matched is None:
                     return False
+                stack.append((c, matched))
         elif self.inputType == "multiple":
-            if not isinstance(annotation.get('value'), list):
+            if not isinstance(value, list):
                 return False
-            for c in self.children:
-                if c.required:
-                    matched = None
-                    for item in annotation.get('value'):
-                        if item.get('key') == c.key:
-                            matched = item
-                    if matched is None or not c.__validate(matched):
+            if self.required_children:
+                items = { item.get('key'): item for item in value }
+                for c in self.required_children:
+                    if items.get(c.key) is None:
                         return False
-            for item in annotation.get('value'):
-                matched = None
-                for c in self.children:
-                    if item.get('key') == c.key:
-                        matched = c
-                if matched is None or not matched.__validate(item):
+            for item in value:
+                matched = self.child_map.get(item.get('key'))
+                if matched is None:
                     return False
+                stack.append((matched, item))
         elif self.inputType == "mutual":
-            if annotation.get('value') is None or annotation.get('value').get('key') is None:
+            if value is None or value.get('key') is None:
                 return False
-            for child in self.children:
-                if annotation.get('value').get('key') == child.key:
-                    return child.__validate(annotation.get('value'))
+            child = self.child_map.get(value.get('key'))
+            if child is None:
+                return False
+            stack.append((child, value))
         elif self.inputType is None:
             pass
 
         return True
 
+    def __collect_errors(self, stack, errors):
+        # stack holds (node, answer, path) entries still to be checked
+        while stack:
+            node, annotation, path = stack.pop()
+            if not isinstance(annotation, dict):
+                errors.append({ 'path': path, 'error': -5 })
+            elif annotation.get('key') != node.key:
+                errors.append({ 'path': path, 'error': -4 })
+            else:
+                node.__collect_value_errors(annotation.get('value'), path, errors, stack)
+
+    def __collect_value_errors(self, value, path, errors, stack):
+        if self.inputType == "text":
+            if not isinstance(value, str):
+                errors.append({ 'path': path, 'error': -2 })
+        elif self.inputType in ["multiple", "property"]:
+            if not isinstance(value, list):
+                errors.append({ 'path': path, 'error': -5 })
+                return
+            items = {}
+            for item in value:
+                if not isinstance(item, dict):
+                    errors.append({ 'path': path, 'error': -5 })
+                    continue
+                key = item.get('key')
+                child = self.child_map.get(key)
+                if child is None:
+                    errors.append({ 'path': path + [key], 'error': -4 })
+                    continue
+                if self.inputType == "multiple":
+                    stack.append((child, item, path + [key]))
+                elif key in items:
+                    errors.append({ 'path': path + [key], 'error': -5 })
+                items[key] = item
+            for c in self.required_children:
+                if c.key not in items:
+                    errors.append({ 'path': path + [c.key], 'error': -1 })
+                elif self.inputType == "property":
+                    stack.append((c, items[c.key], path + [c.key]))
+        elif self.inputType == "mutual":
+            child = None
+            if isinstance(value, dict):
+                child = self.child_map.get(value.get('key'))
+            if child is None or value.get('key') is None:
+                errors.append({ 'path': path, 'error': -3 })
+            else:
+                stack.append((child, value, path + [child.key]))
+
 
     def validate(self, annotation, value_first=False):
         # validate the answer against the category
+        stack = []
         if value_first:
-            return self.__validate({ 'key': None, 'value': annotation })
-        return self.__validate(annotation)
+            return (self.key is None
+                    and self.__validate_value(annotation, stack)
+                    and self.__validate(stack))
+        stack.append((self, annotation))
+        return self.__validate(stack)
 
+    def compile_validator(self):
+        # validate(annotation, value_first=False) generated for this category,
+        # with the keys and required children inlined; built once per node and
+        # dropped by reindex
+        if self.__validator is None:
+            depth = 0
+            stack = [(self, 1)]
+            while stack:
+                node, level = stack.pop()
+                depth = max(depth, level)
+                if node.children:
+                    stack.extend([(c, level + 1) for c in node.children])
+            nodes = self.__post_order(lambda node: node.children or [])
+            self.__validator = compile_validator(self, nodes, depth)
+        return self.__validator
 
-    def get_compile_errors(self):
-        # return a list of errors
+    def get_validation_errors(self, annotation, value_first=False):
+        # return every violation of the answer in a single pass, each one
+        # addressed by the list of keys leading to it
         errors = []
-        if not self.is_selected:
-            errors.append({
-                'node': self,
-                'error': -2 if self.inputType == "text" else -1
-            })
+        stack = []
+        if value_first:
+            if self.key is not None:
+                errors.append({ 'path': [], 'error': -4 })
+            else:
+                self.__collect_value_errors(annotation, [], errors, stack)
         else:
-            if self.inputType == "property":
-                for c in self.children:
-                    errors += c.get_compile_errors()
-            elif self.inputType == "multiple":
-                for c in self.children:
-                    if c.required or c.is_selected:
-                        errors += c.get_compile_errors()
-            elif self.inputType == "mutual":
-                match_count = 0
-                for c in self.children:
-                    if c.is_selected:
-                        errors += c.get_compile_errors()
-                        match_count += 1
+            stack.append((self, annotation, []))
+        self.__collect_errors(stack, errors)
+        return errors
+
+    def __validate_row(self, validate, annotation, value_first, errors):
+        # a malformed row (e.g. an item that is not a dict) is simply invalid
+        try:
+            valid = validate(annotation, value_first)
+        except (AttributeError, TypeError):
+            valid = False
+        if not errors:
+            return valid
+        # the error walk is only needed for the invalid rows
+        return [] if valid else self.get_validation_errors(annotation, value_first)
+
+    def validate_many(self, annotations, value_first=False, workers=None, chunksize=1000, errors=False):
+        # lazily validate an iterable of answers, yielding one result per row
+        # in input order: a boolean, or the list of validation errors when
+        # errors is set; workers > 1 fans the rows out over a process pool
+        if not workers or workers <= 1:
+            validate = self.compile_validator()
+            for annotation in annotations:
+                yield self.__validate_row(validate, annotation, value_first, errors)
+            return
+
+        rows = iter(annotations)
+        with ProcessPoolExecutor(max_workers=workers,
+                                 initializer=_init_worker,
+                                 initargs=(self.to_category(),)) as pool:
+            pending = deque()
+            while True:
+                # keep a bounded number of chunks in flight so the input is
+                # streamed instead of being read into memory all at once
+                while len(pending) < 2 * workers:
+                    chunk = list(islice(rows, chunksize))
+                    if not chunk:
+                        break
+                    pending.append(pool.submit(_validate_chunk, chunk, value_first, errors))
+                if not pending:
+                    break
+                yield from pending.popleft().result()
+
+    def canonicalize(self, annotation, value_first=False):
+        # a copy of the answer with multiple/property items in category order,
+        # the order compile() produces; unknown items keep their relative
+        # order after the known ones and subtrees under them are not touched
+        if value_first:
+            return self.canonicalize({ 'key': self.key, 'value': annotation })['value']
+        if not isinstance(annotation, dict) or annotation.get('key') != self.key:
+            return annotation
+        result = dict(annotation)
+        stack = [(self, result)]
+        while stack:
+            node, answer = stack.pop()
+            value = answer.get('value')
+            if node.inputType == "mutual" and isinstance(value, dict):
+                child = node.child_map.get(value.get('key'))
+                answer['value'] = dict(value)
+                if child is not None:
+                    stack.append((child, answer['value']))
+            elif node.inputType in ["multiple", "property"] and isinstance(value, list):
+                items = []
+                for item in value:
+                    child = node.child_map.get(item.get('key')) if isinstance(item, dict) else None
+                    if child is None:
+                        items.append((len(node.children), item))
+                    else:
+                        item = dict(item)
+                        items.append((child.index, item))
+                        stack.append((child, item))
+                items.sort(key=lambda i: i[0])
+                answer['value'] = [item for _, item in items]
+        return result
+
+    def to_category(self):
+        # rebuild the category dict this tree was constructed from
+        categories = {}
+        for node in self.__post_order(lambda node: node.children or []):
+            category = { 'key': node.key }
+            if node.inputType is not None:
+                category['inputType'] = node.inputType
+            if node.required:
+                category['required'] = True
+            if node.description:
+                category['description'] = node.description
+            if node.metadata is not None:
+                category['metadata'] = node.metadata
+            if node.children is not None:
+                category['choices'] = [categories.pop(c) for c in node.children]
+            categories[node] = category
+        return categories[self]
+
+
+    def __compile_error_children(self):
+        if not self.is_selected:
+            return []
+        if self.inputType == "property":
+            return self.children
+        elif self.inputType == "multiple":
+            return [c for c in self.children if c.required or c.is_selected]
+        elif self.inputType == "mutual":
+            return [c for c in self.children if c.is_selected]
+        return []
+
+    def get_compile_errors(self):
+        # return a list of errors, the errors of children before their parent
+        errors = []
+        for node in self.__post_order(lambda node: node.__compile_error_children()):
+            if not node.is_selected:
+                errors.append({
+                    'node': node,
+                    'error': -2 if node.inputType == "text" else -1
+                })
+            elif node.inputType == "mutual":
+                match_count = len([c for c in node.children if c.is_selected])
                 if match_count == 0 or match_count > 1:
                     errors.append({
-                        'node': self,
+                        'node': node,
                         'error': -3
                     })
-            elif self.inputType == "text":
-                if not isinstance(self.data, str):
+            elif node.inputType == "text":
+                if not isinstance(node.data, str):
                     errors.append({
-                        'node': self,
+                        'node': node,
                         'error': -2
                     })
-            elif self.inputType is None:
-                pass
         return errors
     
 
@@ -260,64 +743,43 @@ class Annotation:
             return "Value of the text field is not filled."
         elif error == -3:
             return "The mutual field is not selected or over selected."
+        elif error == -4:
+            return "The key does not exist in the category."
+        elif error == -5:
+            return "The value does not match the input type."
         else:
             return "Unknown error"
 
 
     @staticmethod
-    def __querySelector(annotation, tokens):
-        parts = tokens[0].split(".")
-        if parts[0] == ">":
-            tokens = tokens[1:]
-            parts = tokens[0].split(".")
-            if parts[0] != annotation["key"]:
-                return None
-
-        if annotation["key"] == parts[0] or parts[0] == "*":
-            tokens = tokens[1:]
-            if len(tokens) == 0:
-                if len(parts) == 1:
-                    return True if "value" not in annotation else annotation["value"]
-                elif parts[1] == "key":
-                    return annotation.key
-
-        if "value" in annotation:
-            value = annotation["value"]
-            if isinstance(value, list):
-                for child in value:
-                    result = Annotation.__querySelector(child, tokens)
-                    if result is not None:
-                        return result
-            elif isinstance(value, dict):
-                return Annotation.__querySelector(value, tokens)
-
-        return None
-
+    def querySelector(annotation, selector, value_first=False):
+        return compile_selector(selector).query(annotation, value_first)
 
     @staticmethod
-    def querySelector(annotation, selector, value_first=False):
-        tokens = selector.split(" ")
-        if value_first:
-            result = Annotation.__querySelector(
-                {"key": None, "value": annotation}, tokens)
-        else:
-            result = Annotation.__querySelector(annotation, tokens)
-        return None if result is None else result
+    def querySelectorAll(annotation, selector, value_first=False):
+        return compile_selector(selector).query_all(annotation, value_first)
 
 
     def __traverse(self, annotation, handler):
-        handler(self, annotation)
-        if "value" in annotation:
-            value = annotation["value"]
-            if isinstance(value, list):
-                for c in self.children:
+        stack = [(self, annotation)]
+        while stack:
+            node, annotation = stack.pop()
+            handler(node, annotation)
+            if "value" in annotation:
+                value = annotation["value"]
+                if isinstance(value, list):
+                    matched = []
                     for child in value:
-                        if c.key == child["key"]:
-                            c.__traverse(child, handler)
-            elif isinstance(value, dict):
-                for c in self.children:
-                    if c.key == value["key"]:
-                        c.__traverse(value, handler)
+                        c = node.child_map.get(child["key"])
+                        if c is not None:
+                            matched.append((c, child))
+                    # visit in category order, as the answer order is arbitrary
+                    matched.sort(key=lambda m: m[0].index)
+                    stack.extend(reversed(matched))
+                elif isinstance(value, dict):
+                    c = node.child_map.get(value["key"])
+                    if c is not None:
+                        stack.append((c, value))
 
     def traverse(self, annotation, handler, value_first=False):
         if value_first:
@@ -326,51 +788,47 @@ class Annotation:
             self.__traverse(annotation, handler)
 
     def get_all_nodes(self):
-        nodes = [self]
-        for c in self.children:
-            nodes += c.get_all_nodes()
-        return nodes
-
-    def __queryMetadata(self, tokens):
-        parts = tokens[0].split(".")
-        if parts[0] == ">":
-            tokens = tokens[1:]
-            parts = tokens[0].split(".")
-            if parts[0] != self.key:
-                return None
-
-        if self.key == parts[0] or parts[0] == "*":
-            tokens = tokens[1:]
-            if len(tokens) == 0:
-                if len(parts) == 1:
-                    return self
-                elif parts[1] == "data":
-                    return self.is_selected if self.inputType is None else self.data;
-                elif parts[1] == "description":
-                    return self.description
-                elif parts[1] == "key":
-                    return self.key
-                elif parts[1] == "inputType":
-                    return self.inputType
-                elif parts[1] == "metadata":
-                    return self.metadata
-                elif parts[1] == "required":
-                    return self.required
-                elif parts[1] == "choices":
-                    return self.children
-
-        if isinstance(self.children, list):
-            for c in self.children:
-                result = c.__queryMetadata(tokens)
-                if result is not None:
-                    return result
+        return list(self.iter_nodes())
 
+    def queryMetadata(self, selector):
+        selector = compile_selector(selector)
+        if selector.key_path is None:
+            return selector.query_metadata(self)
+        for node in self.__lookup(selector.key_path):
+            result = selector.read_metadata(node)
+            if result is not None:
+                return result
         return None
 
-    def queryMetadata(self, selector):
-        tokens = selector.split(" ")
-        result = self.__queryMetadata(tokens)
-        return None if result is None else result
+    def queryMetadataAll(self, selector):
+        return compile_selector(selector).query_metadata_all(self)
+
+
+def _copy_answer(answer):
+    # deep copy of a compiled answer, without recursion
+    result = dict(answer)
+    stack = [result]
+    while stack:
+        node = stack.pop()
+        value = node.get('value')
+        if isinstance(value, dict):
+            node['value'] = dict(value)
+            stack.append(node['value'])
+        elif isinstance(value, list):
+            node['value'] = [dict(i) for i in value]
+            stack.extend(node['value'])
+    return result
+
+
+# process pool workers for Annotation.validate_many
+_worker_annotation = None
+
+def _init_worker(category):
+    global _worker_annotation
+    _worker_annotation = Annotation(category)
+
+def _validate_chunk(annotations, value_first, errors):
+    return list(_worker_annotation.validate_many(annotations, value_first, errors=errors))
 
 
 if __name__ == '__main__':
@@ -449,6 +907,18 @@ if __name__ == '__main__':
     })
 
     print("Category max_size", va.max_size)
+    # the key index answers the same as the depth-first search
+    for selector in ["car", "type > a", "a > a.description", "lp > lp_type.key", "car > lp_text",
+                     "> car", "> type", "> car > type", "> lp > lp_type.key", "a", "missing > a"]:
+        assert(va.queryMetadata(selector) is compile_selector(selector).query_metadata(va))
+
+    # every match, also below a node where the selector failed
+    nested = { "key": "a", "value": [
+        { "key": "c", "value": { "key": "a", "value": [{ "key": "b", "value": "X" }] } },
+        { "key": "b", "value": "Y" }] }
+    assert(list(Annotation.querySelectorAll(nested, "a > b")) == ["X", "Y"])
+    assert(list(Annotation.querySelectorAll(nested, "a b")) == ["X", "Y"])
+    assert(list(Annotation.querySelectorAll(nested, "> a > b")) == ["Y"])
 
     print(va.queryMetadata("car a.description"))
     print(va.queryMetadata("a > a.description"))
@@ -461,6 +931,13 @@ if __name__ == '__main__':
     print(va.querySelector(annotation, "car lp_text"))
     print(Annotation.querySelector(annotation, "lp > lp_color"))
 
+    # writing the attributes directly is seen by the next compile
+    va.queryMetadata("lp_text").data = "5678"
+    assert(va.querySelector(va.compile(), "car lp_text") == "5678")
+    va.queryMetadata("lp_color").is_selected = False
+    assert(va.querySelector(va.compile(), "lp > lp_color") is None)
+    va.queryMetadata("lp_color").is_selected = True
+
     va.decompile([
             {
                 "key": "lp",
@@ -509,3 +986,83 @@ if __name__ == '__main__':
         value_first=True)
     )
 
+
+    errors = va.get_validation_errors([
+            {
+                "key": "lp",
+                "value": [
+                    {
+                        "key": "lp_color"
+                    },
+                    {
+                        "key": "lp_type",
+                        "value": {
+                            "key": "plate"
+                        }
+                    }
+                ]
+            }
+        ],
+        value_first=True)
+    for error in errors:
+        print(Annotation.interpret_error(error['error']), error['path'])
+
+    # items in category order, whatever order the client sent them in
+    canonical = va.canonicalize([
+            {
+                "key": "lp",
+                "value": [
+                    {
+                        "key": "lp_type",
+                        "value": {
+                            "key": "plate"
+                        }
+                    },
+                    {
+                        "key": "lp_color"
+                    }
+                ]
+            }
+        ],
+        value_first=True)
+    assert([item["key"] for item in canonical[0]["value"]] == ["lp_color", "lp_type"])
+
+    # callbacks of a batch are coalesced: one change per node, reported when
+    # the outermost batch ends
+    changes = []
+    selected = []
+    va.set_on_change(changes.append)
+    lp_text = va.queryMetadata("lp_text")
+    lp_text.set_on_select(selected.append)
+    va.unset()
+    assert(selected == [False] and changes == [])
+    with va.batch():
+        lp_text.set_bubble("1")
+        with va.batch():
+            lp_text.set_bubble("2")
+        assert(changes == [])
+        lp_text.set_bubble("3")
+    path = [lp_text]
+    while path[-1].parent is not None:
+        path.append(path[-1].parent)
+    assert(len(changes) == 1 and set(changes[0]) == set(path))
+    assert(changes[0][lp_text] == { 'selected': True, 'data': "3" })
+    assert(changes[0][va] == { 'selected': True, 'data': None })
+    assert(selected == [False, True])
+    # a node set back to its state at the start of the batch is not reported
+    with va.batch():
+        lp_text.unset()
+        lp_text.set_bubble("3")
+    assert(len(changes) == 1 and selected == [False, True])
+    # decompile is one batch, unchanged nodes are left out
+    annotation = va.compile()
+    va.decompile(annotation)
+    assert(len(changes) == 1)
+    va.decompile(canonical, value_first=True)
+    assert(len(changes) == 2 and lp_text in changes[1] and va not in changes[1])
+    assert(changes[1][lp_text] == { 'selected': False, 'data': None })
+    # without callbacks nothing is recorded, the answer is the same
+    va.set_on_change(None)
+    lp_text.set_on_select(None)
+    va.decompile(annotation)
+    assert(va.compile() == annotation and len(changes) == 2)
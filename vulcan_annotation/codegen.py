@@ -0,0 +1,120 @@
+_LITERALS = (str, int, float, bool, type(None))
+
+# generated functions call each other once per category level
+MAX_DEPTH = 200
+
+
+class _Generator:
+
+    def __init__(self, root):
+        self.root = root
+        self.lines = []
+        self.constants = {}
+        self.names = {}
+
+    def literal(self, value):
+        if type(value) in _LITERALS:
+            return repr(value)
+        name = "_c%d" % len(self.constants)
+        self.constants[name] = value
+        return name
+
+    def body(self, node, indent):
+        # checks the value v of an answer to node, children are already defined
+        pad = " " * indent
+        lines = []
+        if node.inputType == "text":
+            lines.append(pad + "return isinstance(v, str)")
+        elif node.inputType == "property":
+            lines.append(pad + "if not isinstance(v, list) or len(v) != %d:" % len(node.children))
+            lines.append(pad + "    return False")
+            lines.append(pad + "m = { i.get('key'): i for i in v }")
+            for c in node.children:
+                lines.append(pad + "i = m.get(%s)" % self.literal(c.key))
+                lines.append(pad + "if i is None or not %s(i):" % self.names[c])
+                lines.append(pad + "    return False")
+            lines.append(pad + "return True")
+        elif node.inputType == "multiple":
+            lines.append(pad + "if not isinstance(v, list):")
+            lines.append(pad + "    return False")
+            if node.required_children:
+                lines.append(pad + "m = { i.get('key') for i in v }")
+                for c in node.required_children:
+                    lines.append(pad + "if %s not in m:" % self.literal(c.key))
+                    lines.append(pad + "    return False")
+            lines.append(pad + "for i in v:")
+            lines.append(pad + "    f = _get(i.get('key'))")
+            lines.append(pad + "    if f is None or not f(i):")
+            lines.append(pad + "        return False")
+            lines.append(pad + "return True")
+        elif node.inputType == "mutual":
+            lines.append(pad + "if v is None:")
+            lines.append(pad + "    return False")
+            lines.append(pad + "k = v.get('key')")
+            lines.append(pad + "if k is None:")
+            lines.append(pad + "    return False")
+            lines.append(pad + "f = _get(k)")
+            lines.append(pad + "if f is None:")
+            lines.append(pad + "    return False")
+            lines.append(pad + "return f(v)")
+        else:
+            lines.append(pad + "return True")
+        return lines
+
+    def signature(self, name, arg, node):
+        # multiple and mutual nodes dispatch on the key through a bound dict.get
+        if node.inputType in ["multiple", "mutual"]:
+            return "def %s(%s, _get=_d%s.get):" % (name, arg, self.names[node][2:])
+        return "def %s(%s):" % (name, arg)
+
+    def function(self, node):
+        name = "_v%d" % len(self.names)
+        if node.inputType in ["multiple", "mutual"]:
+            self.lines.append("_d%s = { %s }" % (name[2:], ", ".join([
+                "%s: %s" % (self.literal(c.key), self.names[c]) for c in node.children
+            ])))
+        self.names[node] = name
+        self.lines.append(self.signature(name, "a", node))
+        self.lines.append("    if a.get('key') != %s:" % self.literal(node.key))
+        self.lines.append("        return False")
+        if node.inputType is not None:
+            self.lines.append("    v = a.get('value')")
+        self.lines.extend(self.body(node, 4))
+        self.lines.append("")
+
+    def generate(self, nodes):
+        # nodes in post-order, so every function is defined after its children
+        for node in nodes:
+            self.function(node)
+        root = self.names[self.root]
+        # the root once more without the key check, for value_first answers
+        self.lines.append(self.signature("_v_value", "v", self.root))
+        self.lines.extend(self.body(self.root, 4))
+        self.lines.append("")
+        self.lines.append("def validate(annotation, value_first=False):")
+        self.lines.append("    if value_first:")
+        if self.root.key is None:
+            self.lines.append("        return _v_value(annotation)")
+        else:
+            self.lines.append("        return False")
+        self.lines.append("    return %s(annotation)" % root)
+        return "\n".join(self.lines) + "\n"
+
+
+def generate_validator_source(root, nodes):
+    generator = _Generator(root)
+    return generator.generate(nodes), generator.constants
+
+
+def compile_validator(root, nodes, depth):
+    # nodes is the subtree of root in post-order; very deep categories would
+    # exceed the recursion limit in the generated code, they keep the
+    # interpreted validate
+    if depth > MAX_DEPTH:
+        return root.validate
+    source, constants = generate_validator_source(root, nodes)
+    namespace = dict(constants)
+    exec(compile(source, "<validator %s>" % root.key, "exec"), namespace)
+    validate = namespace["validate"]
+    validate.source = source
+    return validate
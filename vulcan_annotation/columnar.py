@@ -0,0 +1,122 @@
+import numpy as np
+
+
+# one column per category node below the root, named by its key path in
+# selector syntax ("car > type"); mutual nodes hold the chosen key, text
+# nodes the text value and every other node a selected flag
+
+
+def _nodes(category):
+    nodes = []
+    stack = [(category, None)]
+    while stack:
+        node, path = stack.pop()
+        nodes.append((node, path))
+        if node.children is not None:
+            for c in reversed(node.children):
+                stack.append((c, str(c.key) if path is None else path + " > " + str(c.key)))
+    return nodes
+
+
+def column_names(category):
+    return [path for _, path in _nodes(category)[1:]]
+
+
+def _fill(columns, offset, category, annotation, row):
+    # explicit stack of (node, answer) pairs, deep categories are not limited
+    # by the recursion limit
+    stack = [(category, annotation)]
+    while stack:
+        node, annotation = stack.pop()
+        value = annotation.get('value')
+        if node.inputType == "text":
+            columns[node.ordinal - offset][row] = value
+        elif node.inputType == "mutual":
+            if isinstance(value, dict):
+                child = node.child_map.get(value.get('key'))
+                if child is not None:
+                    columns[node.ordinal - offset][row] = child.key
+                    stack.append((child, value))
+        elif node.inputType in ["multiple", "property"]:
+            columns[node.ordinal - offset][row] = True
+            if isinstance(value, list):
+                for item in value:
+                    child = node.child_map.get(item.get('key'))
+                    if child is not None:
+                        stack.append((child, item))
+        else:
+            columns[node.ordinal - offset][row] = True
+
+
+def to_columns(category, annotations, value_first=False):
+    # flatten a batch of answers into {path: numpy array} in a single pass
+    annotations = list(annotations)
+    nodes = _nodes(category)
+    offset = category.ordinal
+    columns = [
+        np.full(len(annotations), None, dtype=object)
+        if node.inputType in ["text", "mutual"]
+        else np.zeros(len(annotations), dtype=bool)
+        for node, _ in nodes
+    ]
+    for row, annotation in enumerate(annotations):
+        if annotation is None:
+            continue
+        if value_first:
+            annotation = { 'key': category.key, 'value': annotation }
+        if annotation.get('key') == category.key:
+            _fill(columns, offset, category, annotation, row)
+    return { path: columns[node.ordinal - offset] for node, path in nodes[1:] }
+
+
+if __name__ == '__main__':
+    from vulcan_annotation import Annotation
+
+    va = Annotation({
+        "key": "car",
+        "inputType": "multiple",
+        "choices": [
+        {
+            "key": "type",
+            "inputType": "mutual",
+            "choices": [{ "key": "sedan" }, { "key": "truck" }]
+        },
+        {
+            "key": "lp_text",
+            "inputType": "text"
+        },
+        {
+            "key": "damaged"
+        }]
+    })
+    assert(column_names(va) == ["type", "type > sedan", "type > truck", "lp_text", "damaged"])
+
+    columns = to_columns(va, [
+        { "key": "car", "value": [{ "key": "type", "value": { "key": "truck" } }, { "key": "lp_text", "value": "1234" }] },
+        { "key": "car", "value": [{ "key": "damaged" }, { "key": "unknown" }] },
+        None,
+        { "key": "bus", "value": [{ "key": "damaged" }] },
+    ])
+    assert(list(columns["type"]) == ["truck", None, None, None])
+    assert(list(columns["type > truck"]) == [True, False, False, False])
+    assert(list(columns["type > sedan"]) == [False, False, False, False])
+    assert(list(columns["lp_text"]) == ["1234", None, None, None])
+    assert(list(columns["damaged"]) == [False, True, False, False])
+    assert(list(to_columns(va, [[{ "key": "damaged" }]], value_first=True)["damaged"]) == [True])
+
+    # deeper than the recursion limit
+    depth = 5000
+    category = { "key": "n0", "inputType": "mutual", "choices": [] }
+    leaf = category
+    for i in range(1, depth):
+        child = { "key": "n%d" % i, "inputType": "mutual", "choices": [] }
+        leaf["choices"].append(child)
+        leaf = child
+    leaf["inputType"] = "text"
+    del leaf["choices"]
+    va = Annotation(category)
+    leaf = va.queryMetadata("n%d" % (depth - 1))
+    leaf.set_bubble("x")
+    columns = to_columns(va, [va.compile(shared=True)])
+    assert(len(columns) == depth - 1)
+    assert(columns[column_names(va)[-1]][0] == "x")
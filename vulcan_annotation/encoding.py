@@ -0,0 +1,104 @@
+import numpy as np
+
+from .state import AnnotationState
+
+
+# an answer is encoded as one bit per category node, indexed by the node's
+# depth-first ordinal, plus a side table of text values keyed by the same
+# ordinals; the vector width is category.node_count for every answer
+
+
+def encode(category, annotation, value_first=False):
+    state = AnnotationState(category)
+    state.decompile(annotation, value_first)
+    offset = category.ordinal
+    bits = np.zeros(category.node_count, dtype=bool)
+    bits[[o - offset for o in state.selected]] = True
+    texts = { o - offset: d for o, d in state.data.items() }
+    return bits, texts
+
+
+def decode(category, bits, texts=None, value_first=False):
+    # inverse of encode, returns the answer in the format of compile()
+    state = AnnotationState(category)
+    offset = category.ordinal
+    state.selected = { int(i) + offset for i in np.flatnonzero(bits) }
+    if texts:
+        state.data = { int(o) + offset: d for o, d in texts.items() }
+    if category.ordinal not in state.selected:
+        return None
+    return state.compile(value_first)
+
+
+def encode_many(category, annotations, value_first=False):
+    # a (rows x category.node_count) boolean matrix and one text table per row
+    rows = []
+    texts = []
+    for annotation in annotations:
+        bits, text = encode(category, annotation, value_first)
+        rows.append(bits)
+        texts.append(text)
+    if not rows:
+        return np.zeros((0, category.node_count), dtype=bool), texts
+    return np.stack(rows), texts
+
+
+def decode_many(category, matrix, texts=None, value_first=False):
+    for i, bits in enumerate(matrix):
+        yield decode(category, bits, None if texts is None else texts[i], value_first)
+
+
+if __name__ == '__main__':
+    from vulcan_annotation import Annotation
+
+    va = Annotation({
+        "key": "car",
+        "inputType": "multiple",
+        "choices": [
+        {
+            "key": "type",
+            "inputType": "mutual",
+            "choices": [{ "key": "sedan" }, { "key": "truck" }]
+        },
+        {
+            "key": "lp",
+            "inputType": "property",
+            "choices": [
+            {
+                "key": "lp_text",
+                "inputType": "text"
+            },
+            {
+                "key": "lp_color"
+            }]
+        },
+        {
+            "key": "damaged"
+        }]
+    })
+
+    answers = [
+        { "key": "car", "value": [{ "key": "type", "value": { "key": "truck" } }, { "key": "damaged" }] },
+        { "key": "car", "value": [
+            { "key": "lp", "value": [{ "key": "lp_text", "value": "1234" }, { "key": "lp_color" }] }] },
+        { "key": "car", "value": [] },
+    ]
+    for annotation in answers:
+        va.decompile(annotation)
+        bits, texts = encode(va, annotation)
+        assert(len(bits) == va.node_count)
+        assert(decode(va, bits, texts) == va.compile())
+        assert(decode(va, *encode(va, annotation["value"], True), value_first=True) == va.compile(True))
+
+    # a subtree is encoded relative to its own ordinal
+    lp = va.queryMetadata("lp")
+    lp_answer = answers[1]["value"][0]
+    lp.decompile(lp_answer)
+    assert(decode(lp, *encode(lp, lp_answer)) == lp.compile())
+
+    matrix, texts = encode_many(va, answers)
+    assert(matrix.shape == (len(answers), va.node_count))
+    for annotation, decoded in zip(answers, decode_many(va, matrix, texts)):
+        va.decompile(annotation)
+        assert(decoded == va.compile())
+    assert(decode(va, np.zeros(va.node_count, dtype=bool)) is None)
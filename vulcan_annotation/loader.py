@@ -0,0 +1,157 @@
+import hashlib
+import json
+import os
+import pickle
+from collections import OrderedDict
+from importlib.metadata import version
+
+from .annotation import Annotation
+
+
+# pickled trees only load back into the Annotation layout that wrote them,
+# so the package version and slots are part of the cache file name
+_LAYOUT = hashlib.sha256(repr((version('vulcan_annotation'), Annotation.__slots__)).encode("utf-8")).hexdigest()[:16]
+
+
+class CategoryCache:
+
+    # constructed category trees keyed by the sha256 of the category json;
+    # the same tree is handed out to every caller, so keep per-session
+    # selections in an AnnotationState rather than on the tree itself
+
+    def __init__(self, maxsize=32, cache_dir=None):
+        self.maxsize = maxsize
+        self.cache_dir = cache_dir
+        self.hits = 0
+        self.misses = 0
+        self.__trees = OrderedDict()
+        # (path, mtime, size) -> digest, so unchanged files are not re-read
+        self.__digests = OrderedDict()
+
+    def __remember(self, table, key, value):
+        table[key] = value
+        table.move_to_end(key)
+        if len(table) > self.maxsize:
+            table.popitem(last=False)
+
+    def __pickle_path(self, digest):
+        return os.path.join(self.cache_dir, "%s.%s.pickle" % (digest, _LAYOUT))
+
+    def __load_pickle(self, digest):
+        if self.cache_dir is None:
+            return None
+        try:
+            with open(self.__pickle_path(digest), "rb") as f:
+                return pickle.load(f)
+        except (OSError, pickle.UnpicklingError, EOFError, RecursionError):
+            return None
+
+    def __save_pickle(self, digest, tree):
+        # the disk cache is best effort: very deep trees exceed the recursion
+        # limit of pickle and are only kept in memory
+        os.makedirs(self.cache_dir, exist_ok=True)
+        path = self.__pickle_path(digest)
+        tmp_path = "%s.%d.tmp" % (path, os.getpid())
+        try:
+            with open(tmp_path, "wb") as f:
+                pickle.dump(tree, f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp_path, path)
+        except (OSError, pickle.PicklingError, RecursionError):
+            try:
+                os.remove(tmp_path)
+            except OSError:
+                pass
+
+    def __build(self, digest, content):
+        tree = self.__trees.get(digest)
+        if tree is not None:
+            self.hits += 1
+            self.__trees.move_to_end(digest)
+            return tree
+        self.misses += 1
+        tree = self.__load_pickle(digest)
+        if tree is None:
+            tree = Annotation(json.loads(content))
+            if self.cache_dir is not None:
+                self.__save_pickle(digest, tree)
+        self.__remember(self.__trees, digest, tree)
+        return tree
+
+    def loads(self, content):
+        if isinstance(content, str):
+            content = content.encode("utf-8")
+        return self.__build(hashlib.sha256(content).hexdigest(), content)
+
+    def load(self, path):
+        stat = os.stat(path)
+        stat_key = (os.path.abspath(path), stat.st_mtime_ns, stat.st_size)
+        digest = self.__digests.get(stat_key)
+        if digest is not None and digest in self.__trees:
+            return self.__build(digest, None)
+        with open(path, "rb") as f:
+            content = f.read()
+        digest = hashlib.sha256(content).hexdigest()
+        self.__remember(self.__digests, stat_key, digest)
+        return self.__build(digest, content)
+
+    def clear(self):
+        self.hits = 0
+        self.misses = 0
+        self.__trees.clear()
+        self.__digests.clear()
+
+
+_default_cache = CategoryCache()
+
+def load_category(path):
+    return _default_cache.load(path)
+
+
+if __name__ == '__main__':
+    import tempfile
+
+    def write(path, category, mtime=None):
+        with open(path, "w") as f:
+            json.dump(category, f)
+        if mtime is not None:
+            os.utime(path, ns=(mtime, mtime))
+
+    car = { "key": "car", "inputType": "multiple", "choices": [{ "key": "damaged" }] }
+    bus = { "key": "bus", "inputType": "multiple", "choices": [{ "key": "damaged" }] }
+
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "car.json")
+        write(path, car, 1000000000)
+        cache = CategoryCache(maxsize=2, cache_dir=os.path.join(directory, "pickles"))
+        tree = cache.load(path)
+        assert(cache.load(path) is tree and (cache.hits, cache.misses) == (1, 1))
+
+        # the same content under another name or with a new mtime is a hit
+        other = os.path.join(directory, "copy.json")
+        write(other, car)
+        assert(cache.load(other) is tree)
+        write(path, car, 2000000000)
+        assert(cache.load(path) is tree and (cache.hits, cache.misses) == (3, 1))
+
+        # an edited file is built again
+        write(path, bus, 3000000000)
+        edited = cache.load(path)
+        assert(edited is not tree and edited.key == "bus" and cache.misses == 2)
+
+        # at most maxsize trees are kept, the least recently used goes first
+        cache.loads(json.dumps({ "key": "truck" }))
+        assert(cache.load(other) is not tree and cache.misses == 4)
+
+        # trees are pickled as <sha256>.<layout>.pickle and read back by a
+        # new cache; a bus tree is written in place of the car tree to show
+        # that the file is used rather than the json
+        names = os.listdir(cache.cache_dir)
+        digest = hashlib.sha256(json.dumps(car).encode("utf-8")).hexdigest()
+        assert("%s.%s.pickle" % (digest, _LAYOUT) in names and len(names) == 3)
+        with open(os.path.join(cache.cache_dir, "%s.%s.pickle" % (digest, _LAYOUT)), "wb") as f:
+            pickle.dump(Annotation(bus), f)
+        assert(CategoryCache(cache_dir=cache.cache_dir).load(other).key == "bus")
+        # pickles of another layout are ignored
+        os.rename(os.path.join(cache.cache_dir, "%s.%s.pickle" % (digest, _LAYOUT)),
+                  os.path.join(cache.cache_dir, "%s.0000000000000000.pickle" % digest))
+        assert(CategoryCache(cache_dir=cache.cache_dir).load(other).key == "car")
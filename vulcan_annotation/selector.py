@@ -0,0 +1,173 @@
+from functools import lru_cache
+
+
+METADATA_FIELDS = {
+    'data': lambda node: node.is_selected if node.inputType is None else node.data,
+    'description': lambda node: node.description,
+    'key': lambda node: node.key,
+    'inputType': lambda node: node.inputType,
+    'metadata': lambda node: node.metadata,
+    'required': lambda node: node.required,
+    'choices': lambda node: node.children,
+}
+
+
+class Selector:
+
+    def __init__(self, selector):
+        self.selector = selector
+        # each step is (key, field, direct) where direct marks a "> key" step
+        self.steps = []
+        direct = False
+        for token in selector.split():
+            if token == ">":
+                direct = True
+                continue
+            parts = token.split(".")
+            self.steps.append((parts[0], parts[1] if len(parts) > 1 else None, direct))
+            direct = False
+        if direct or not self.steps:
+            raise ValueError("Invalid selector: %r" % selector)
+        self.field = self.steps[-1][1]
+        # plain "k1 > k2 > ..." selectors can be answered from a key index; a
+        # leading ">" anchors the first key at the root, left to the search
+        if not self.steps[0][2] and all(key != "*" and (direct or i == 0)
+                                        for i, (key, _, direct) in enumerate(self.steps)):
+            self.key_path = tuple(key for key, _, _ in self.steps)
+        else:
+            self.key_path = None
+
+    def __repr__(self):
+        return "Selector(%r)" % self.selector
+
+    def __step(self, key, states):
+        # the steps still open below a node with this key, and whether the node
+        # completes the selector; a descendant step stays open whether or not
+        # it matched, so matches below a failed or a completed step are found
+        matched = False
+        following = set()
+        for i in states:
+            step_key, _, direct = self.steps[i]
+            if key == step_key or (step_key == "*" and not direct):
+                if i + 1 == len(self.steps):
+                    matched = True
+                else:
+                    following.add(i + 1)
+            if not direct:
+                following.add(i)
+        return matched, following
+
+    def __read_answer(self, annotation):
+        if self.field is None:
+            return True if "value" not in annotation else annotation["value"]
+        elif self.field == "key":
+            return annotation["key"]
+        return None
+
+    def __match(self, annotation):
+        # depth-first search with an explicit stack of (answer, step) pairs; it
+        # commits to the first answer matching a step, like the original
+        # querySelector, so it is only used for the first match
+        stack = [(annotation, 0)]
+        while stack:
+            annotation, i = stack.pop()
+            key, field, direct = self.steps[i]
+            if annotation["key"] == key or (key == "*" and not direct):
+                if i + 1 == len(self.steps):
+                    result = self.__read_answer(annotation)
+                    if result is not None:
+                        return result
+                    continue
+                i += 1
+            elif direct:
+                continue
+
+            if "value" in annotation:
+                value = annotation["value"]
+                if isinstance(value, list):
+                    stack.extend([(child, i) for child in reversed(value)])
+                elif isinstance(value, dict):
+                    stack.append((value, i))
+        return None
+
+    def __match_all(self, annotation):
+        # every matching answer once, in depth-first order, with the set of
+        # open steps carried down the stack
+        stack = [(annotation, (0,))]
+        while stack:
+            annotation, states = stack.pop()
+            matched, following = self.__step(annotation["key"], states)
+            if matched:
+                result = self.__read_answer(annotation)
+                if result is not None:
+                    yield result
+            if following and "value" in annotation:
+                value = annotation["value"]
+                if isinstance(value, list):
+                    stack.extend([(child, following) for child in reversed(value)])
+                elif isinstance(value, dict):
+                    stack.append((value, following))
+
+    def query(self, annotation, value_first=False):
+        if value_first:
+            annotation = { "key": None, "value": annotation }
+        return self.__match(annotation)
+
+    def query_all(self, annotation, value_first=False):
+        # lazily yield every match, including matches nested inside another
+        if value_first:
+            annotation = { "key": None, "value": annotation }
+        return self.__match_all(annotation)
+
+    def query_many(self, annotations, value_first=False):
+        for annotation in annotations:
+            yield self.query(annotation, value_first)
+
+    def __match_metadata(self, node):
+        stack = [(node, 0)]
+        while stack:
+            node, i = stack.pop()
+            key, field, direct = self.steps[i]
+            if node.key == key or (key == "*" and not direct):
+                if i + 1 == len(self.steps):
+                    result = self.read_metadata(node)
+                    if result is not None:
+                        return result
+                    continue
+                i += 1
+            elif direct:
+                continue
+
+            if node.children is not None:
+                stack.extend([(c, i) for c in reversed(node.children)])
+        return None
+
+    def __match_metadata_all(self, node):
+        stack = [(node, (0,))]
+        while stack:
+            node, states = stack.pop()
+            matched, following = self.__step(node.key, states)
+            if matched:
+                result = self.read_metadata(node)
+                if result is not None:
+                    yield result
+            if following and node.children is not None:
+                stack.extend([(c, following) for c in reversed(node.children)])
+
+    def read_metadata(self, node):
+        if self.field is None:
+            return node
+        getter = METADATA_FIELDS.get(self.field)
+        return None if getter is None else getter(node)
+
+    def query_metadata(self, node):
+        return self.__match_metadata(node)
+
+    def query_metadata_all(self, node):
+        return self.__match_metadata_all(node)
+
+
+@lru_cache(maxsize=256)
+def compile_selector(selector):
+    # selectors are parsed once and reused for every answer they run against
+    return Selector(selector)
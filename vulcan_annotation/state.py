@@ -0,0 +1,174 @@
+class AnnotationState:
+
+    # selection of one session over a shared Annotation category tree; the
+    # tree itself is never modified, nodes are addressed by their ordinal
+
+    def __init__(self, category):
+        self.category = category
+        self.selected = set()
+        self.data = {}
+
+    def is_selected(self, node):
+        return node.ordinal in self.selected
+
+    def get_data(self, node):
+        return self.data.get(node.ordinal)
+
+    def toggle(self, node):
+        if self.is_selected(node):
+            self.unset(node)
+        else:
+            self.set(node)
+
+    def set(self, node, data=None):
+        self.selected.add(node.ordinal)
+        if node.inputType == "text":
+            self.data[node.ordinal] = data
+        elif node.inputType == "mutual":
+            for child in node.children:
+                if data is None or child.key != data:
+                    self.unset(child)
+                else:
+                    self.set(child)
+        if node.parent and node.parent.inputType == "mutual":
+            for child in node.parent.children:
+                if child is not node and self.is_selected(child):
+                    self.unset(child)
+
+    def unset(self, node):
+        # a subtree occupies a contiguous range of ordinals
+        start = node.ordinal
+        end = start + node.node_count
+        if node.node_count < len(self.selected):
+            for ordinal in range(start, end):
+                self.selected.discard(ordinal)
+        else:
+            self.selected = { o for o in self.selected if not start <= o < end }
+        if self.data:
+            self.data = { o: d for o, d in self.data.items() if not start <= o < end }
+
+    def set_bubble(self, node, data=None):
+        self.selected.add(node.ordinal)
+        if node.inputType == "text":
+            self.data[node.ordinal] = data
+        elif node.inputType == "mutual" and data is not None:
+            for child in node.children:
+                if child.key != data:
+                    self.unset(child)
+                else:
+                    self.set(child)
+        node = node.parent
+        while node is not None:
+            self.selected.add(node.ordinal)
+            node = node.parent
+
+    def __post_order(self, node, visit):
+        # nodes reached through visit(node) -> children, children first, with
+        # an explicit stack like Annotation so deep categories do not recurse
+        order = []
+        stack = [node]
+        while stack:
+            node = stack.pop()
+            order.append(node)
+            stack.extend(visit(node))
+        order.reverse()
+        return order
+
+
+    def __compile_children(self, node):
+        if node.ordinal not in self.selected or not node.children:
+            return []
+        return [c for c in node.children if c.ordinal in self.selected]
+
+    def __compile_fragment(self, node, fragments):
+        # the fragments of the selected children are already built
+        if node.ordinal not in self.selected:
+            return None
+        if node.inputType == "text":
+            return { 'key': node.key, 'value': self.data.get(node.ordinal) }
+        elif node.inputType == "mutual":
+            for child in node.children:
+                if child.ordinal in self.selected:
+                    return { 'key': node.key, 'value': fragments[child.ordinal] }
+        elif node.inputType in ["multiple", "property"]:
+            data = []
+            for child in node.children:
+                if child.ordinal in self.selected:
+                    cc = fragments[child.ordinal]
+                    if cc is not None:
+                        data.append(cc)
+            return { 'key': node.key, 'value': data }
+        elif node.inputType is None:
+            return { 'key': node.key }
+
+    def __compile(self, node):
+        fragments = {}
+        for n in self.__post_order(node, self.__compile_children):
+            fragments[n.ordinal] = self.__compile_fragment(n, fragments)
+        return fragments[node.ordinal]
+
+    def compile(self, value_first=False):
+        data_obj = self.__compile(self.category)
+        if value_first:
+            return data_obj.get('value')
+        return data_obj
+
+    def __decompile(self, node, annotation):
+        stack = [(node, annotation)]
+        while stack:
+            node, annotation = stack.pop()
+            self.selected.add(node.ordinal)
+            if node.inputType == "text":
+                self.data[node.ordinal] = annotation.get('value')
+            elif node.inputType in ["multiple", "property"]:
+                for item in annotation.get('value'):
+                    child = node.child_map.get(item.get('key'))
+                    if child is not None:
+                        stack.append((child, item))
+            elif node.inputType == "mutual":
+                if annotation.get('value') is not None:
+                    child = node.child_map.get(annotation.get('value').get('key'))
+                    if child is not None:
+                        stack.append((child, annotation.get('value')))
+
+    def decompile(self, annotation, value_first=False):
+        # only the nodes named in the answer are visited
+        self.selected = set()
+        self.data = {}
+        self.__decompile(self.category, { 'value': annotation } if value_first else annotation)
+
+
+    def __compile_error_children(self, node):
+        if node.ordinal not in self.selected:
+            return []
+        if node.inputType == "property":
+            return node.children
+        elif node.inputType == "multiple":
+            return [c for c in node.children if c.required or c.ordinal in self.selected]
+        elif node.inputType == "mutual":
+            return [c for c in node.children if c.ordinal in self.selected]
+        return []
+
+    def get_compile_errors(self):
+        # the errors of children before their parent, as in Annotation
+        errors = []
+        for node in self.__post_order(self.category, self.__compile_error_children):
+            if node.ordinal not in self.selected:
+                errors.append({
+                    'node': node,
+                    'error': -2 if node.inputType == "text" else -1
+                })
+            elif node.inputType == "mutual":
+                match_count = len([c for c in node.children if c.ordinal in self.selected])
+                if match_count == 0 or match_count > 1:
+                    errors.append({
+                        'node': node,
+                        'error': -3
+                    })
+            elif node.inputType == "text":
+                if not isinstance(self.data.get(node.ordinal), str):
+                    errors.append({
+                        'node': node,
+                        'error': -2
+                    })
+        return errors
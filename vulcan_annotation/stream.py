@@ -0,0 +1,201 @@
+import gzip
+import json
+import time
+
+from .annotation import Annotation
+
+
+class StreamStats:
+
+    def __init__(self):
+        self.rows = 0
+        self.invalid = 0
+        self.bytes = 0
+        self.started = time.perf_counter()
+
+    @property
+    def elapsed(self):
+        return time.perf_counter() - self.started
+
+    @property
+    def rows_per_second(self):
+        elapsed = self.elapsed
+        return self.rows / elapsed if elapsed > 0 else 0.0
+
+    @property
+    def bytes_per_second(self):
+        elapsed = self.elapsed
+        return self.bytes / elapsed if elapsed > 0 else 0.0
+
+    def __repr__(self):
+        return "StreamStats(rows=%d, invalid=%d, bytes=%d, %.0f rows/s, %.1f MB/s)" % (
+            self.rows, self.invalid, self.bytes,
+            self.rows_per_second, self.bytes_per_second / 1e6)
+
+
+def _open(path, mode, compress):
+    # gzip is used for *.gz paths unless compress says otherwise
+    if compress is None:
+        compress = str(path).endswith(".gz")
+    if compress:
+        return gzip.open(path, mode + "b")
+    return open(path, mode + "b")
+
+
+class JsonlReader:
+
+    # the answers of a JSON Lines file, read one at a time; with a category
+    # each row is validated and invalid rows either raise ValueError or,
+    # with on_invalid="skip", are counted in stats and dropped
+
+    def __init__(self, path, category=None, value_first=False, on_invalid="raise", compress=None, stats=None):
+        if on_invalid not in ["raise", "skip"]:
+            raise ValueError("on_invalid must be 'raise' or 'skip'")
+        self.stats = StreamStats() if stats is None else stats
+        self.__rows = self.__read(path, category, value_first, on_invalid, compress)
+
+    def __read(self, path, category, value_first, on_invalid, compress):
+        stats = self.stats
+        with _open(path, "r", compress) as f:
+            for line_no, line in enumerate(f, 1):
+                stats.bytes += len(line)
+                if not line.strip():
+                    continue
+                try:
+                    annotation = json.loads(line)
+                except ValueError as e:
+                    if on_invalid == "raise":
+                        raise ValueError("line %d: %s" % (line_no, e)) from e
+                    stats.invalid += 1
+                    continue
+                if category is not None:
+                    errors = next(category.validate_many((annotation,), value_first, errors=True))
+                    if errors:
+                        if on_invalid == "raise":
+                            raise ValueError("line %d: %s" % (line_no, "; ".join([
+                                "%s at %s" % (Annotation.interpret_error(e['error']), e['path'])
+                                for e in errors
+                            ])))
+                        stats.invalid += 1
+                        continue
+                stats.rows += 1
+                yield annotation
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        return next(self.__rows)
+
+    def close(self):
+        # closes the file of a reader that is not read to the end
+        self.__rows.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+def read_jsonl(path, category=None, value_first=False, on_invalid="raise", compress=None, stats=None):
+    # a lazy iterator over the answers; its stats are filled in while reading
+    return JsonlReader(path, category, value_first, on_invalid, compress, stats)
+
+
+class JsonlWriter:
+
+    def __init__(self, path, compress=None, stats=None):
+        self.stats = StreamStats() if stats is None else stats
+        self.__file = _open(path, "w", compress)
+
+    def write(self, annotation):
+        # one answer per line, e.g. the output of Annotation.compile()
+        line = (json.dumps(annotation, ensure_ascii=False) + "\n").encode("utf-8")
+        self.__file.write(line)
+        self.stats.rows += 1
+        self.stats.bytes += len(line)
+
+    def write_many(self, annotations):
+        for annotation in annotations:
+            self.write(annotation)
+
+    def close(self):
+        self.__file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+def write_jsonl(path, annotations, compress=None):
+    with JsonlWriter(path, compress) as writer:
+        writer.write_many(annotations)
+    return writer.stats
+
+
+if __name__ == '__main__':
+    import os
+    import tempfile
+
+    va = Annotation({
+        "key": "car",
+        "inputType": "multiple",
+        "choices": [
+        {
+            "key": "lp_text",
+            "inputType": "text",
+            "required": True
+        },
+        {
+            "key": "damaged"
+        }]
+    })
+    answers = [
+        { "key": "car", "value": [{ "key": "lp_text", "value": "1234" }] },
+        { "key": "car", "value": [{ "key": "lp_text", "value": "5678" }, { "key": "damaged" }] },
+    ]
+
+    with tempfile.TemporaryDirectory() as directory:
+        for name in ["answers.jsonl", "answers.jsonl.gz"]:
+            path = os.path.join(directory, name)
+            stats = write_jsonl(path, answers)
+            assert(stats.rows == 2)
+            with open(path, "rb") as f:
+                assert((f.read(2) == b"\x1f\x8b") == name.endswith(".gz"))
+            reader = read_jsonl(path, va)
+            assert(list(reader) == answers)
+            assert(reader.stats.rows == 2 and reader.stats.invalid == 0)
+            assert(reader.stats.bytes == stats.bytes)
+
+        # a missing required field, a row that is not JSON and a blank line
+        path = os.path.join(directory, "invalid.jsonl.gz")
+        with gzip.open(path, "wb") as f:
+            f.write(b"\n".join([
+                json.dumps(answers[0]).encode(),
+                json.dumps({ "key": "car", "value": [{ "key": "damaged" }] }).encode(),
+                b"{ not json",
+                b"",
+                json.dumps(answers[1]).encode(),
+            ]) + b"\n")
+        reader = read_jsonl(path, va, on_invalid="skip")
+        assert(list(reader) == [answers[0], answers[1]])
+        assert(reader.stats.rows == 2 and reader.stats.invalid == 2)
+
+        try:
+            list(read_jsonl(path, va))
+            assert(False)
+        except ValueError as e:
+            assert(str(e).startswith("line 2: The required field is not selected."))
+        try:
+            list(read_jsonl(path))
+            assert(False)
+        except ValueError as e:
+            assert(str(e).startswith("line 3: "))
+
+        # a reader stopped early closes its file
+        with read_jsonl(os.path.join(directory, "answers.jsonl"), va) as reader:
+            assert(next(reader) == answers[0])
+        assert(reader.stats.rows == 1)
@@ -1,6 +1,29 @@
+import json
+from collections import OrderedDict
+from hashlib import blake2b
+from concurrent.futures import ProcessPoolExecutor
 from Levenshtein import distance as sdist
 
 
+def _pair_items(from_items, to_items):
+    # keyed-list matching: (key, from item, to item) with None for the missing
+    # side, removed keys first and then the keys of to_items in order; a key
+    # listed twice keeps its last item
+    fdv_hash = {
+        i["key"]: i
+        for i in from_items
+    }
+    tdv_hash = {
+        i["key"]: i
+        for i in to_items
+    }
+    for k, f in fdv_hash.items():
+        if k not in tdv_hash:
+            yield k, f, None
+    for k, t in tdv_hash.items():
+        yield k, fdv_hash.get(k), t
+
+
 def divergence(from_dict, to_dict):
     if from_dict is None:
         if to_dict is None:
@@ -27,30 +50,415 @@ def divergence(from_dict, to_dict):
         elif isinstance(to_dict["value"], dict):
             return divergence(from_dict["value"], to_dict["value"])
         elif isinstance(to_dict["value"], list):
-            fdv_hash = {
-                i["key"]: i
-                for i in from_dict["value"]
-            }
-            tdv_hash = {
-                i["key"]: i
-                for i in to_dict["value"]
-            }
+            div = 0
+            # a removed item counts 1, every other item its own divergence
+            for k, f, t in _pair_items(from_dict["value"], to_dict["value"]):
+                div += 1 if t is None else divergence(f, t)
+
+            return div
+
+
+
+
+def _bounded_divergence(from_dict, to_dict, budget):
+    # exact divergence when it is within budget, otherwise any value above it
+    if budget < 0:
+        return 0
+    if from_dict is None:
+        if to_dict is None:
+            return 0
+        elif "value" not in to_dict:
+            return 1
+        elif isinstance(to_dict["value"], str):
+            return 1 + len(to_dict["value"])
+        elif isinstance(to_dict["value"], dict):
+            return 1 + _bounded_divergence(None, to_dict["value"], budget - 1)
+        elif isinstance(to_dict["value"], list):
+            div = 1
+            for i in to_dict["value"]:
+                if div > budget:
+                    break
+                div += _bounded_divergence(None, i, budget - div)
+            return div
+    else:
+        if to_dict is None:
+            return 1
 
+        if to_dict["key"] != from_dict["key"]:
+            return 1 + _bounded_divergence(None, to_dict, budget - 1)
+
+        if "value" not in to_dict:
+            return 0 if "value" not in from_dict else 1
+        elif isinstance(to_dict["value"], str):
+            return sdist(from_dict["value"], to_dict["value"], score_cutoff=budget)
+        elif isinstance(to_dict["value"], dict):
+            return _bounded_divergence(from_dict["value"], to_dict["value"], budget)
+        elif isinstance(to_dict["value"], list):
             div = 0
-            # for each key in fdv not in tdv, div += 1
-            for k in fdv_hash:
-                if k not in tdv_hash:
-                    div += 1
-            
-            # for each key in tdv, div += divergence(fdv[k], tdv[k])
-            for k in tdv_hash:
-                if k not in fdv_hash:
-                    div += divergence(None, tdv_hash[k])
-                else:
-                    div += divergence(fdv_hash[k], tdv_hash[k])
+            for k, f, t in _pair_items(from_dict["value"], to_dict["value"]):
+                if div > budget:
+                    break
+                div += 1 if t is None else _bounded_divergence(f, t, budget - div)
+
+            return div
+
+
+def divergence_within(from_dict, to_dict, max_distance):
+    # divergence(from_dict, to_dict) if it does not exceed max_distance,
+    # otherwise max_distance + 1; stops as soon as the budget is spent
+    div = _bounded_divergence(from_dict, to_dict, max_distance)
+    return div if div <= max_distance else max_distance + 1
+
+# answers flattened once into (key, kind, payload, weight) tuples so that
+# many comparisons can reuse the keyed lists; weight is divergence(None, node)
+NO_VALUE, TEXT, SINGLE, LIST = 0, 1, 2, 3
+
+def _keyed(answer):
+    if answer is None:
+        return None
+    key = answer["key"]
+    value = answer.get("value")
+    if value is None:
+        return (key, NO_VALUE, None, 1)
+    elif isinstance(value, str):
+        return (key, TEXT, value, 1 + len(value))
+    elif isinstance(value, dict):
+        child = _keyed(value)
+        return (key, SINGLE, child, 1 + child[3])
+    elif isinstance(value, list):
+        children = [_keyed(i) for i in value]
+        return (key, LIST, { c[0]: c for c in children }, 1 + sum([c[3] for c in children]))
+
+
+def _keyed_divergence(from_node, to_node):
+    # same as divergence() on the answers the nodes were built from
+    if from_node is None:
+        return 0 if to_node is None else to_node[3]
+    if to_node is None:
+        return 1
+
+    if to_node[0] != from_node[0]:
+        return 1 + to_node[3]
+
+    kind = to_node[1]
+    if kind == NO_VALUE:
+        return 0 if from_node[1] == NO_VALUE else 1
+    elif kind == TEXT:
+        return sdist(from_node[2], to_node[2])
+    elif kind == SINGLE:
+        return _keyed_divergence(from_node[2], to_node[2])
+    else:
+        fdv_hash = from_node[2]
+        tdv_hash = to_node[2]
+        div = 0
+        for k in fdv_hash:
+            if k not in tdv_hash:
+                div += 1
+        for k, t in tdv_hash.items():
+            f = fdv_hash.get(k)
+            div += t[3] if f is None else _keyed_divergence(f, t)
+        return div
+
+
+_matrix_nodes = None
 
+def _init_matrix_worker(nodes):
+    global _matrix_nodes
+    _matrix_nodes = nodes
+
+def _matrix_rows(rows, nodes=None):
+    nodes = _matrix_nodes if nodes is None else nodes
+    return [
+        [0 if i == j else _keyed_divergence(nodes[i], t) for j, t in enumerate(nodes)]
+        for i in rows
+    ]
+
+
+def divergence_matrix(answers, workers=None):
+    # m[i][j] == divergence(answers[i], answers[j]) for every pair
+    import numpy as np
+
+    nodes = [_keyed(a) for a in answers]
+    n = len(nodes)
+    matrix = np.zeros((n, n), dtype=np.int64)
+    if not workers or workers <= 1 or n < 2:
+        if n:
+            matrix[:] = _matrix_rows(range(n), nodes)
+        return matrix
+
+    step = max(1, n // (4 * workers))
+    chunks = [range(i, min(i + step, n)) for i in range(0, n, step)]
+    with ProcessPoolExecutor(max_workers=workers,
+                             initializer=_init_matrix_worker,
+                             initargs=(nodes,)) as pool:
+        for rows, values in zip(chunks, pool.map(_matrix_rows, chunks)):
+            matrix[rows.start:rows.stop] = values
+    return matrix
+
+
+
+def _value_kind(answer):
+    value = answer.get("value")
+    if value is None:
+        return NO_VALUE
+    elif isinstance(value, str):
+        return TEXT
+    elif isinstance(value, dict):
+        return SINGLE
+    return LIST
+
+
+def diff(from_dict, to_dict):
+    # node-level patch turning from_dict into to_dict, None when they are equal:
+    #   { "replace": answer }          a different key or kind of value
+    #   { "value": text }              a changed text value
+    #   { "value": patch }             a patch to the answer of a mutual node
+    #   { "items": { "remove": [key], "add": [item], "patch": [[key, patch]],
+    #                "order": [key] } }  changes to a keyed list, "order"
+    #                                    only when the items are reordered
+    if from_dict is to_dict:
+        # compile(shared=True) results reuse their unchanged subtrees
+        return None
+    if from_dict is None or to_dict is None or from_dict["key"] != to_dict["key"]:
+        return None if from_dict == to_dict else { "replace": to_dict }
+
+    kind = _value_kind(to_dict)
+    if kind != _value_kind(from_dict):
+        return { "replace": to_dict }
+    if kind == NO_VALUE:
+        return None
+    elif kind == TEXT:
+        return None if from_dict["value"] == to_dict["value"] else { "value": to_dict["value"] }
+    elif kind == SINGLE:
+        patch = diff(from_dict["value"], to_dict["value"])
+        return None if patch is None else { "value": patch }
+
+    remove, add, patch = [], [], []
+    for k, f, t in _pair_items(from_dict["value"], to_dict["value"]):
+        if t is None:
+            remove.append(k)
+        elif f is None:
+            add.append(t)
+        else:
+            item_patch = diff(f, t)
+            if item_patch is not None:
+                patch.append([k, item_patch])
+
+    # apply_patch keeps the remaining items in place and appends the new ones
+    removed = set(remove)
+    kept = [k for k in { i["key"]: None for i in from_dict["value"] } if k not in removed]
+    order = [i["key"] for i in to_dict["value"]]
+
+    items = {}
+    if remove:
+        items["remove"] = remove
+    if add:
+        items["add"] = add
+    if patch:
+        items["patch"] = patch
+    if order != kept + [i["key"] for i in add]:
+        items["order"] = order
+    return { "items": items } if items else None
+
+
+def apply_patch(answer, patch):
+    # the answer with the patch from diff() applied; the input is not
+    # modified and unchanged subtrees are shared with it
+    if patch is None:
+        return answer
+    if "replace" in patch:
+        return patch["replace"]
+    if "value" in patch:
+        value = patch["value"]
+        if not isinstance(value, str):
+            value = apply_patch(answer["value"], value)
+        return dict(answer, value=value)
+
+    items = patch["items"]
+    current = { i["key"]: i for i in answer["value"] }
+    for k in items.get("remove", []):
+        del current[k]
+    for k, item_patch in items.get("patch", []):
+        current[k] = apply_patch(current[k], item_patch)
+    for i in items.get("add", []):
+        current[i["key"]] = i
+    if "order" in items:
+        value = [current[k] for k in items["order"]]
+    else:
+        value = list(current.values())
+    return dict(answer, value=value)
+
+
+# merkle hash of an answer: a node hashes its json-encoded key, the kind of
+# its value and either the text or the digests of its children, sorted so
+# that list items hash the same in any order
+_DIGEST_SIZE = 16
+
+def _digests(answer, with_paths=False):
+    # pre-order (answer, parent position, path) entries and their digests
+    nodes = []
+    stack = [(answer, -1, [] if with_paths else None)]
+    while stack:
+        node, parent, path = stack.pop()
+        nodes.append((node, parent, path))
+        position = len(nodes) - 1
+        value = node.get("value")
+        if isinstance(value, dict):
+            value = [value]
+        elif not isinstance(value, list):
+            continue
+        for i in value:
+            stack.append((i, position, None if path is None else path + [i.get("key")]))
+
+    children = [[] for _ in nodes]
+    digests = [None] * len(nodes)
+    # children come after their parent in pre-order
+    for position in range(len(nodes) - 1, -1, -1):
+        node, parent, _ = nodes[position]
+        h = blake2b(json.dumps(node.get("key")).encode("utf-8"), digest_size=_DIGEST_SIZE)
+        value = node.get("value")
+        if value is None:
+            h.update(b"\0n")
+        elif isinstance(value, str):
+            h.update(b"\0t")
+            h.update(value.encode("utf-8"))
+        elif isinstance(value, dict):
+            h.update(b"\0s")
+            h.update(children[position][0])
+        elif isinstance(value, list):
+            h.update(b"\0l")
+            h.update(b"".join(sorted(children[position])))
+        else:
+            h.update(b"\0j")
+            h.update(json.dumps(value).encode("utf-8"))
+        digests[position] = h.digest()
+        if parent >= 0:
+            children[parent].append(digests[position])
+    return nodes, digests
+
+
+def content_hash(answer):
+    # stable hex digest of the answer content, the same for answers that only
+    # differ in the order of list items; usable as a storage or cache key
+    if answer is None:
+        return blake2b(b"null", digest_size=_DIGEST_SIZE).hexdigest()
+    return _digests(answer)[1][0].hex()
+
+
+def subtree_hashes(answer):
+    # (path, hex digest) for every node of the answer, children before their
+    # parents; path is the list of keys below the root, as in
+    # get_validation_errors
+    if answer is None:
+        return
+    nodes, digests = _digests(answer, with_paths=True)
+    for position in range(len(nodes) - 1, -1, -1):
+        yield nodes[position][2], digests[position].hex()
+
+
+class DivergenceCache:
+
+    # memoized divergence keyed by interned ids of the compared subtrees, so
+    # equal subtrees hit whatever their item order; an answer compared many
+    # times should go through prepare() once, interning it is the main cost
+    # of a call
+
+    def __init__(self, maxsize=100000):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self.__results = OrderedDict()
+        # subtree -> id; ids are never reused, so an evicted subtree only
+        # gets a fresh id and its old memo entries age out
+        self.__ids = OrderedDict()
+        self.__next_id = 0
+
+    def __intern(self, identity):
+        node_id = self.__ids.get(identity)
+        if node_id is None:
+            node_id = self.__next_id
+            self.__next_id += 1
+            self.__ids[identity] = node_id
+            if len(self.__ids) > self.maxsize:
+                self.__ids.popitem(last=False)
+        return node_id
+
+    def __prepare(self, answer):
+        # (key, kind, payload, weight, id) like _keyed, where weight is
+        # divergence(None, answer) and lists keep their last item per key
+        key = answer["key"]
+        value = answer.get("value")
+        if value is None:
+            kind, payload, weight, part = NO_VALUE, None, 1, None
+        elif isinstance(value, str):
+            kind, payload, weight, part = TEXT, value, 1 + len(value), value
+        elif isinstance(value, dict):
+            payload = self.__prepare(value)
+            kind, weight, part = SINGLE, 1 + payload[3], payload[4]
+        elif isinstance(value, list):
+            children = [self.__prepare(i) for i in value]
+            payload = { c[0]: c for c in children }
+            kind, weight = LIST, 1 + sum([c[3] for c in children])
+            part = tuple(sorted([c[4] for c in payload.values()]))
+        return (key, kind, payload, weight, self.__intern((key, kind, part, weight)))
+
+    def prepare(self, answer):
+        # the interned form of an answer, accepted by divergence() in its place
+        if answer is None or isinstance(answer, tuple):
+            return answer
+        return self.__prepare(answer)
+
+    def __divergence(self, from_node, to_node):
+        # divergence(None, to) is the weight carried by the prepared node
+        if from_node is None:
+            return 0 if to_node is None else to_node[3]
+        if to_node is None:
+            return 1
+
+        memo_key = (from_node[4], to_node[4])
+        div = self.__results.get(memo_key)
+        if div is not None:
+            self.__results.move_to_end(memo_key)
+            self.hits += 1
             return div
+        self.misses += 1
+
+        if to_node[0] != from_node[0]:
+            div = 1 + to_node[3]
+        elif to_node[1] == NO_VALUE:
+            div = 0 if from_node[1] == NO_VALUE else 1
+        elif to_node[1] == TEXT:
+            div = sdist(from_node[2], to_node[2])
+        elif to_node[1] == SINGLE:
+            div = self.__divergence(from_node[2], to_node[2])
+        else:
+            fdv_hash = dict(from_node[2])
+            div = 0
+            for k, t in to_node[2].items():
+                div += self.__divergence(fdv_hash.pop(k, None), t)
+            div += len(fdv_hash)
+
+        self.__results[memo_key] = div
+        if len(self.__results) > self.maxsize:
+            self.__results.popitem(last=False)
+        return div
+
+    def divergence(self, from_dict, to_dict):
+        return self.__divergence(self.prepare(from_dict), self.prepare(to_dict))
+
+    def info(self):
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'size': len(self.__results),
+            'maxsize': self.maxsize
+        }
 
+    def clear(self):
+        self.hits = 0
+        self.misses = 0
+        self.__results.clear()
+        self.__ids.clear()
 
 if __name__ == '__main__':
     assert(sdist("theresa", "tesla") == 4)
@@ -101,4 +509,45 @@ if __name__ == '__main__':
     assert(divergence(to_dict, to_dict) == 0)
 
     assert(divergence(None, None) == 0)
-    assert(divergence(from_dict, None) == 1)
\ No newline at end of file
+    assert(divergence(from_dict, None) == 1)
+
+    answers = [from_dict, to_dict, None]
+    matrix = divergence_matrix(answers)
+    for i, a in enumerate(answers):
+        for j, b in enumerate(answers):
+            assert(matrix[i][j] == divergence(a, b))
+    assert((divergence_matrix(answers, workers=2) == matrix).all())
+
+    assert(divergence_within(from_dict, to_dict, 12) == 12)
+    assert(divergence_within(from_dict, to_dict, 11) == 12)
+    assert(divergence_within(from_dict, to_dict, 3) == 4)
+    assert(divergence_within(None, to_dict, 100) == 5 + 11)
+
+    assert(diff(from_dict, from_dict) is None)
+    assert(diff(None, None) is None)
+    assert(apply_patch(from_dict, diff(from_dict, to_dict)) == to_dict)
+    assert(apply_patch(to_dict, diff(to_dict, from_dict)) == from_dict)
+    assert(apply_patch(None, diff(None, to_dict)) == to_dict)
+    assert(diff(from_dict, to_dict)["items"]["remove"] == ["1"])
+    assert(diff(from_dict, to_dict)["items"]["patch"] == [["2", { "value": "theresa" }]])
+    reordered = dict(from_dict, value=list(reversed(from_dict["value"])))
+    assert(diff(from_dict, reordered) == { "items": { "order": ["2", "1"] } })
+    assert(from_dict["value"][1]["value"] == "tesla")
+
+    assert(content_hash(reordered) == content_hash(from_dict))
+    assert(content_hash(to_dict) != content_hash(from_dict))
+    assert(content_hash({ "key": 1 }) != content_hash({ "key": "1" }))
+    assert(content_hash({ "key": "1" }) != content_hash({ "key": "1", "value": "" }))
+    hashes = list(subtree_hashes(to_dict))
+    assert(hashes[-1] == ([], content_hash(to_dict)))
+    assert((["0", "1"], content_hash(to_dict["value"][0]["value"])) in hashes)
+    assert(len(hashes) == 5)
+
+    cache = DivergenceCache(maxsize=16)
+    assert(cache.divergence(from_dict, to_dict) == 4 + 4 + 4)
+    assert(cache.divergence(from_dict, to_dict) == 4 + 4 + 4)
+    assert(cache.divergence(None, to_dict) == 5 + 11)
+    assert(cache.hits == 1)
+    prepared = cache.prepare(to_dict)
+    assert(cache.divergence(cache.prepare(from_dict), prepared) == 4 + 4 + 4)
+    assert(cache.divergence(from_dict, reordered) == 0)